@@ -2,33 +2,154 @@ import asyncio
 import os
 import re
 import json
+import logging
+import time
 import aiohttp
+import numpy as np
+from contextlib import aclosing
 from typing import List, Optional, Dict
 from pydantic import BaseModel, Field, ValidationError, HttpUrl
-from langchain_openai import ChatOpenAI
-from langchain.schema import HumanMessage
+from langchain_core.messages import HumanMessage, SystemMessage
 from dotenv import load_dotenv
-from async_search import get_clean_pages_texts
+from utils.http_client import start_http_client
+from async_search import (PagesResult, collapse_duplicate_snippets, get_clean_pages_texts, get_search_snippets,
+                          iter_clean_pages_texts, normalize_query, search_local_pages, shared_work)
+from utils.cache import TieredCache
+from utils.llm_cache import LLMCache, schema_json
+from utils.deadline import deadline_after, deadline_passed, timeout_scope
+from utils.metrics import ITERATIONS, span
+from utils.near_duplicates import merge_mirrors, record_saved
+from utils.option_matcher import OptionMatcher
+from utils.ranker import bm25_scores, count_static_tokens, count_tokens, select_passages
+from utils.scheduler import PRIORITY_HIGH, PRIORITY_LOW, Overloaded, UpstreamScheduler, current_priority
+from utils.singleflight import SingleFlight
 
 load_dotenv()
 
-# Инициализация модели OpenAI
-llm = ChatOpenAI(
-    api_key=os.getenv('OPENAI_API_KEY'),
-    base_url="https://api.proxyapi.ru/openai/v1",
-    model="gpt-4o-mini"
+# Логгер сервиса; обработчики настраивает main через setup_logger
+logger = logging.getLogger('api_logger')
+
+# 'pipelined' передаёт страницы в суммаризацию по мере загрузки, 'staged' ждёт каждый этап целиком
+PIPELINE_MODE = os.getenv('PIPELINE_MODE', 'pipelined')
+# Сколько готовых саммари достаточно для первой попытки синтеза, пока остальные ещё в работе
+SYNTHESIS_QUORUM = int(os.getenv('SYNTHESIS_QUORUM', 3))
+
+# Спекулятивный режим: сразу N разных запросов и параллельные ветки поиска вместо 4 последовательных итераций
+SPECULATIVE_BRANCHES = int(os.getenv('SPECULATIVE_BRANCHES', 0))
+# Сколько веток может выполняться одновременно (ограничение расхода токенов и квоты поиска)
+SPECULATIVE_MAX_CONCURRENCY = int(os.getenv('SPECULATIVE_MAX_CONCURRENCY', 2))
+
+speculative_stats = {'runs': 0, 'branches_started': 0, 'branches_cancelled': 0, 'clear_answers': 0}
+
+# Ранжирование фрагментов: со страниц берётся до PAGE_TEXT_LENGTH символов текста, а в LLM уходят
+# только самые релевантные вопросу и вариантам ответа фрагменты в пределах PASSAGE_TOKEN_BUDGET токенов
+PASSAGE_RANKING = os.getenv('PASSAGE_RANKING', '1') == '1'
+PAGE_TEXT_LENGTH = int(os.getenv('PAGE_TEXT_LENGTH', 20000 if PASSAGE_RANKING else 1000))
+PASSAGE_TOKEN_BUDGET = int(os.getenv('PASSAGE_TOKEN_BUDGET', 1200))
+
+# Пакетная суммаризация: до SUMMARY_BATCH_SIZE страниц в одном вызове LLM в пределах SUMMARY_BATCH_TOKEN_BUDGET
+# токенов контента; 0 или 1 - отдельный вызов на каждую страницу
+SUMMARY_BATCH_SIZE = int(os.getenv('SUMMARY_BATCH_SIZE', 0))
+SUMMARY_BATCH_TOKEN_BUDGET = int(os.getenv('SUMMARY_BATCH_TOKEN_BUDGET', 6000))
+
+# Экстрактивный ответ без LLM: если на страницах дословно встречается ровно один вариант ответа
+# (рядом со словами из вопроса, минимум на EXTRACTIVE_MIN_SOURCES страницах), суммаризация и синтез пропускаются
+EXTRACTIVE_MATCHING = os.getenv('EXTRACTIVE_MATCHING', '1') == '1'
+EXTRACTIVE_MIN_SOURCES = int(os.getenv('EXTRACTIVE_MIN_SOURCES', 2))
+EXTRACTIVE_MIN_CONTEXT = int(os.getenv('EXTRACTIVE_MIN_CONTEXT', 2))
+
+# Сначала ответ по заголовкам и пассажам из выдачи Yandex (без загрузки страниц): матчер вариантов,
+# затем один вызов синтеза; страницы загружаются, только если ответ по сниппетам не ясен
+SNIPPET_FIRST = os.getenv('SNIPPET_FIRST', '1') == '1'
+SNIPPET_MAX_RESULTS = int(os.getenv('SNIPPET_MAX_RESULTS', 10))
+
+snippet_stats = {'attempts': 0, 'extractive_answers': 0, 'llm_answers': 0, 'unclear': 0}
+
+# Доказательства копятся между итерациями запроса: уже обработанные URL не загружаются повторно,
+# а в синтез кроме новых саммари уходят лучшие из прошлых, всего не больше EVIDENCE_MAX_SUMMARIES
+EVIDENCE_MAX_SUMMARIES = int(os.getenv('EVIDENCE_MAX_SUMMARIES', 8))
+
+evidence_stats = {'requests': 0, 'iterations': 0, 'urls_skipped': 0, 'summaries_reused': 0}
+
+# Срок ответа на запрос по умолчанию, секунды (в запросе можно передать свой timeout); по истечении
+# незавершённая работа отменяется и возвращается лучший ответ, полученный к этому моменту
+REQUEST_TIMEOUT = float(os.getenv('REQUEST_TIMEOUT', 60))
+
+deadline_stats = {'requests': 0, 'expired': 0, 'degraded_answers': 0, 'empty_answers': 0}
+
+summary_batch_stats = {'batches': 0, 'batched_pages': 0, 'single_pages': 0, 'fallbacks': 0}
+
+pipeline_stats = {
+    'runs': 0,
+    'early_answers': 0,
+    'extractive_answers': 0,
+    'cancelled_summaries': 0,
+    'wall_seconds': 0.0,
+    'fetch_seconds': 0.0,
+    'summarize_seconds': 0.0,
+    'synthesize_seconds': 0.0,
+    # Сумма длительностей этапов минус фактическое время: сколько сэкономил пайплайн
+    'overlap_seconds': 0.0,
+}
+
+# Клиент OpenAI создаётся лениво в каждом процессе: с gunicorn --preload модуль импортируется в мастере,
+# и HTTP-клиент, созданный до fork, оказался бы общим для всех воркеров
+_llm = None
+_llm_pid = None
+
+# Планировщик вызовов LLM: лимиты запросов и токенов в минуту на воркер, очередь с приоритетами
+llm_scheduler = UpstreamScheduler(
+    'openai',
+    requests_per_minute=float(os.getenv('LLM_RPM', 500)),
+    tokens_per_minute=float(os.getenv('LLM_TPM', 200000)),
+    max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', 16)),
+    max_queue=int(os.getenv('LLM_MAX_QUEUE', 256)),
+    max_retries=int(os.getenv('UPSTREAM_MAX_RETRIES', 4)),
+    # openai.APIConnectionError добавляется в get_llm, чтобы не импортировать openai при старте
+    retry_exceptions=(asyncio.TimeoutError,),
 )
 
+# Кэш структурированных вызовов LLM, SQLite-уровень общий для всех воркеров
+llm_cache = LLMCache(
+    TieredCache(
+        'llm_calls',
+        maxsize=int(os.getenv('LLM_CACHE_SIZE', 2048)),
+        ttl=float(os.getenv('LLM_CACHE_TTL', 24 * 3600)),
+        path=os.getenv('LLM_CACHE_PATH', 'cache/llm.sqlite') or None,
+        disk_maxsize=int(os.getenv('LLM_CACHE_DISK_SIZE', 100000)),
+    ),
+    enabled=os.getenv('LLM_CACHE_ENABLED', '1') == '1',
+    scheduler=llm_scheduler,
+)
+
+
+def get_llm():
+    """Модель OpenAI текущего процесса; повторы при 429/5xx делает планировщик, а не клиент"""
+    global _llm, _llm_pid
+    if _llm is None or _llm_pid != os.getpid():
+        import openai
+        from langchain_openai import ChatOpenAI
+
+        llm_scheduler.retry_exceptions = (asyncio.TimeoutError, openai.APIConnectionError)
+        _llm = ChatOpenAI(
+            api_key=os.getenv('OPENAI_API_KEY'),
+            base_url=os.getenv('OPENAI_BASE_URL', "https://api.proxyapi.ru/openai/v1"),
+            model="gpt-4o-mini",
+            max_retries=0,
+        )
+        _llm_pid = os.getpid()
+    return _llm
+
 # =====================
 # Precisely Accurate Prompts
 # =====================
 
+# Каждый промпт - статическая инструкция (SystemMessage) и данные запроса после неё (HumanMessage):
+# одинаковый префикс у всех вызовов одного типа попадает в автоматический префиксный кэш провайдера
+
 relevant_search_query = """
 Ты - профессиональный поисковый стратег с экспертизой в информационной ретривной оптимизации. Твоя задача - создавать поисковые запросы-ключи, которые точно открывают нужные данные. 
 
-Исходные данные:
-Вопрос: {question}
-
 Критерии идеального запроса:
 1. **Полное сохранение смысла**: Обязательно включи все ключевые элементы вопроса (числа, даты, уникальные названия)
 2. **Структурный паттерн**: [Событие/организация] [Искомый факт] [Конкретизирующие параметры] [Год]
@@ -49,11 +170,13 @@ relevant_search_query = """
 Сгенерируй ТОЛЬКО ОДИН оптимальный поисковый запрос без кавычек и пунктуации.
 """
 
+relevant_search_query_input = """
+Исходные данные:
+Вопрос: {question}
+"""
+
 edit_search_query = """
 Ты - поисковый аналитик уровня Senior с компетенцией в query refinement. Твоя роль - проводить диагностику неудачных запросов и перепроектировать их с учетом поведенческих факторов поисковых систем.
-Вопрос: {question}  
-
-Предыдущий поисковой запрос не выдал нужных результатов: {search_query}
 
 Обрати внимание на:  
 - Ключевые слова и смысловые единицы вопроса  
@@ -64,6 +187,29 @@ edit_search_query = """
 Выведи только готовый поисковый запрос.
 """
 
+edit_search_query_input = """
+Вопрос: {question}  
+
+Предыдущий поисковой запрос не выдал нужных результатов: {search_query}
+"""
+
+diverse_search_queries = """
+Ты - профессиональный поисковый стратег с экспертизой в информационной ретривной оптимизации. Твоя задача - составить несколько РАЗНЫХ поисковых запросов, которые будут выполнены параллельно, чтобы хотя бы один из них открыл нужные данные.
+
+Требования:
+1. Составь ровно столько запросов, сколько указано в исходных данных
+2. Каждый запрос сохраняет ключевые элементы вопроса (числа, даты, уникальные названия)
+3. Запросы должны отличаться подходом: официальная формулировка, формулировка новостей, короткий запрос из ключевых слов, запрос с указанием вероятного сайта-источника
+4. Не включай варианты ответа в запросы
+5. Оптимальная длина каждого запроса: 5-15 смысловых единиц, без кавычек и пунктуации
+"""
+
+diverse_search_queries_input = """
+Исходные данные:
+Вопрос: {question}
+Количество запросов: {count}
+"""
+
 summary_by_question = """
 Ты - AI-аналитик информации 4-го уровня с сертификацией CRTA (Contextual Relevance & Text Analysis). Твоя миссия - экстрагировать факты с хирургической точностью.
 
@@ -74,21 +220,103 @@ summary_by_question = """
   * Обязательная проверка кросс-референсов
   * Жесткий приоритет первичных данных
 
+Шаги для выполнения:  
+1. Внимательно проанализируй вопрос. Определи его суть.  
+2. Изучи представленный контент, выделяя факты, относящиеся к вопросу.  
+3. Игнорируй нерелевантные или второстепенные детали.  
+4. Будь внимателен к целевому вопросу, не путай схожие термины, будь предельно точен в формулировках
+5. Структурируй ответ четко и емко, сохраняя объективность.  
+
+Выведи важную информацию из контента, которая поможет ответить на вопрос. Если релевантной информации нету, так и напиши.
+"""
+
+summary_by_question_input = """
 Вопрос: {question}  
 
 Контент (фрагмент):  
 {content}  
+"""
+
+batch_summary_by_question = """
+Ты - AI-аналитик информации 4-го уровня с сертификацией CRTA (Contextual Relevance & Text Analysis). Твоя миссия - экстрагировать факты с хирургической точностью.
+
+Ролевой профиль:
+- Спецтехника: метод "Контекстуального скальпеля"
+- Принципы работы:
+  * Zero-tolerance к ментальным прыжкам
+  * Обязательная проверка кросс-референсов
+  * Жесткий приоритет первичных данных
+
+Тебе дано несколько независимых источников. Обработай КАЖДЫЙ источник отдельно, не смешивая их факты.
 
 Шаги для выполнения:  
 1. Внимательно проанализируй вопрос. Определи его суть.  
-2. Изучи представленный контент, выделяя факты, относящиеся к вопросу.  
+2. Для каждого источника выдели факты, относящиеся к вопросу.  
 3. Игнорируй нерелевантные или второстепенные детали.  
 4. Будь внимателен к целевому вопросу, не путай схожие термины, будь предельно точен в формулировках
 5. Структурируй ответ четко и емко, сохраняя объективность.  
 
-Выведи важную информацию из контента, которая поможет ответить на вопрос. Если релевантной информации нету, так и напиши.
+Верни ровно одно саммари на каждый источник, в том же порядке, с url источника в поле source. Если в источнике нет релевантной информации, так и напиши в его саммари.
+"""
+
+batch_summary_by_question_input = """
+Вопрос: {question}  
+
+Источников: {count}
+
+{sources}
+"""
+
+synthesis_instructions = """
+Ты — senior fact-checker международного аналитического агентства. Твоя задача — проводить аудит информации 
+по строгому протоколу Due Diligence для финансовых отчетов. Твои решения влияют на стратегические решения компаний.
+
+Принципы работы:
+1. Режим «Нулевого доверия»: любое утверждение требует двойного подтверждения из источников
+2. Приоритет первичных данных: работа только с явно указанными фактами
+3. Протокол расхождений: автоматическое вето при любых противоречиях
+4. Документированная трассировка: каждая часть ответа должна иметь явную ссылку на источник
+
+Требования к анализу:
+1. Тщательно сравни каждое числовое значение, дату или точный факт из источников с вариантами ответов
+2. Выбор возможен ТОЛЬКО если есть точное совпадение формулировки в проверяемом источнике
+3. Запрещено делать предположения, интерполяции или выбирать "ближайший" вариант
+4. Если несколько источников противоречат друг другу - вернуть null
+5. Если информация отсутствует/неполная/неоднозначная - вернуть null
+
+Шаги формирования ответа:
+"Анализ": 
+[
+"Поиск точных соответствий для каждого варианта в источниках",
+"Проверка противоречий между источниками",
+"Оценка полноты информации"
+],
+
+"Выбор опции": "ТОЛЬКО номер варианта при 100% совпадении",
+"Выбор источников, с которых взят ответ": "Цитата из источника с подтверждением",
+"is_answer_clear": True или False - твоя уверенность в ответе,
+"""
+
+synthesis_input = """
+Аналитический кейс:
+
+Вопрос: {question}
+
+Доступные варианты ответа: 
+{mcq_options}
+
+Релевантная информация из источников:
+{summaries}
 """
 
+# Статические части промптов создаются один раз: их размер в токенах считается однократно (count_static_tokens)
+RELEVANT_SEARCH_QUERY = SystemMessage(content=relevant_search_query)
+EDIT_SEARCH_QUERY = SystemMessage(content=edit_search_query)
+DIVERSE_SEARCH_QUERIES = SystemMessage(content=diverse_search_queries)
+SUMMARY_BY_QUESTION = SystemMessage(content=summary_by_question)
+BATCH_SUMMARY_BY_QUESTION = SystemMessage(content=batch_summary_by_question)
+SYNTHESIS_INSTRUCTIONS = SystemMessage(content=synthesis_instructions)
+
 # =====================
 # Structured Models
 # =====================
@@ -98,12 +326,20 @@ class SearchQuery(BaseModel):
         description="Пошаговый анализ контента и взаимосвязи с вопросом, выделение данных для точного ответа на вопрос")
     search_query: str = Field(description="Чистый поисковый запрос без упоминания вариантов ответа")
 
+class SearchQueries(BaseModel):
+    coT: list[str] = Field(
+        description="Пошаговый анализ вопроса и выбор разных подходов к поиску")
+    search_queries: list[str] = Field(description="Разные чистые поисковые запросы без упоминания вариантов ответа")
+
 class ContentSummary(BaseModel):
     coT: list[str] = Field(
         description="Пошаговый анализ контента и взаимосвязи с вопросом, выделение данных для точного ответа на вопрос")
     summary: str = Field(description="Точная часть контента, связанная с вопросом.")
     source: str = Field(description="http url источника информации, формат HttpUrl")
 
+class BatchContentSummary(BaseModel):
+    summaries: list[ContentSummary] = Field(description="Саммари по каждому источнику в порядке их перечисления")
+
 class AnswerResponse(BaseModel):
     reasoning: str = Field(description="Проанализируй информацию и выбери правильный вариант ответа.")
     is_answer_clear: bool = Field(description="Действительно ли выбранный тобой ответ кажется тебе прозрачным")
@@ -125,25 +361,53 @@ def validate_mcq(query: str) -> Optional[List[int]]:
 # LLM Chains
 # =====================
 
-async def generate_search_query(question: str) -> str:
+async def generate_search_query(question: str, use_cache: bool = True) -> str:
     """Генерация поискового запроса с StructuredOutput"""
-    chain = llm.with_structured_output(SearchQuery)
-    result = await chain.ainvoke([HumanMessage(content=relevant_search_query.format(question=question))])
+    result = await llm_cache.invoke(
+        get_llm(), SearchQuery, [RELEVANT_SEARCH_QUERY,
+                           HumanMessage(content=relevant_search_query_input.format(question=question))],
+        use_cache=use_cache)
     return result.search_query
 
-async def regenerate_search_query(question: str, search_query: str) -> str:
+async def regenerate_search_query(question: str, search_query: str, use_cache: bool = True) -> str:
     """Генерация поискового запроса с StructuredOutput"""
-    chain = llm.with_structured_output(SearchQuery)
-    result = await chain.ainvoke(
-        [HumanMessage(content=edit_search_query.format(question=question, search_query=search_query))])
+    result = await llm_cache.invoke(
+        get_llm(), SearchQuery, [EDIT_SEARCH_QUERY, HumanMessage(
+            content=edit_search_query_input.format(question=question, search_query=search_query))],
+        use_cache=use_cache)
     return result.search_query
 
-async def summarize_single_content(question: str, content: str, url: str) -> ContentSummary:
+async def generate_search_queries(question: str, count: int, use_cache: bool = True) -> List[str]:
+    """Генерация нескольких разных поисковых запросов одним вызовом"""
+    result = await llm_cache.invoke(
+        get_llm(), SearchQueries, [DIVERSE_SEARCH_QUERIES, HumanMessage(
+            content=diverse_search_queries_input.format(question=question, count=count))],
+        use_cache=use_cache)
+    queries, seen = [], set()
+    for query in result.search_queries:
+        key = normalize_query(query)
+        if key and key not in seen:
+            seen.add(key)
+            queries.append(query)
+    return queries[:count]
+
+def prepare_content(question: str, content: str) -> str:
+    """Фрагмент страницы, который уходит в LLM"""
+    if PASSAGE_RANKING:
+        return select_passages(content, question, token_budget=PASSAGE_TOKEN_BUDGET)
+    return content[:5000]
+
+async def summarize_single_content(question: str, content: str, url: str, prepared: bool = False,
+                                   use_cache: bool = True) -> ContentSummary:
     """Helper to summarize a single content piece."""
-    chain = llm.with_structured_output(ContentSummary)
+    if not prepared:
+        content = prepare_content(question, content)
     try:
-        summary = await chain.ainvoke(
-            [HumanMessage(content=summary_by_question.format(question=question, content=content[:5000]))])
+        with span('summarize'):
+            summary = await llm_cache.invoke(
+                get_llm(), ContentSummary, [SUMMARY_BY_QUESTION, HumanMessage(
+                    content=summary_by_question_input.format(question=question, content=content))],
+                use_cache=use_cache)
         return ContentSummary(coT=summary.coT, summary=summary.summary, source=url)
     except Exception as e:
         return ContentSummary(
@@ -152,64 +416,76 @@ async def summarize_single_content(question: str, content: str, url: str) -> Con
             source=url
         )
 
-async def summarize_content(question: str, search_results: List[Dict]) -> List[ContentSummary]:
+async def summarize_batch(question: str, pages: List[tuple], use_cache: bool = True) -> List[ContentSummary]:
+    """Суммаризация нескольких подготовленных страниц одним вызовом; при ошибке разбора - по одной странице"""
+    if len(pages) == 1:
+        summary_batch_stats['single_pages'] += 1
+        return [await summarize_single_content(question, pages[0][1], pages[0][0], prepared=True,
+                                               use_cache=use_cache)]
+
+    sources = "\n\n".join(f"Источник {i} ({url}):\n{content}" for i, (url, content) in enumerate(pages, 1))
+    try:
+        with span('summarize_batch'):
+            result = await llm_cache.invoke(get_llm(), BatchContentSummary, [BATCH_SUMMARY_BY_QUESTION, HumanMessage(
+                content=batch_summary_by_question_input.format(question=question, count=len(pages), sources=sources))],
+                use_cache=use_cache)
+        if len(result.summaries) != len(pages):
+            raise ValueError(f"Expected {len(pages)} summaries, got {len(result.summaries)}")
+        summary_batch_stats['batches'] += 1
+        summary_batch_stats['batched_pages'] += len(pages)
+        return [ContentSummary(coT=summary.coT, summary=summary.summary, source=url)
+                for summary, (url, _) in zip(result.summaries, pages)]
+    except Exception:
+        summary_batch_stats['fallbacks'] += 1
+        summary_batch_stats['single_pages'] += len(pages)
+        return list(await asyncio.gather(*[summarize_single_content(question, content, url, prepared=True,
+                                                                    use_cache=use_cache)
+                                           for url, content in pages]))
+
+def pack_batches(pages: List[tuple], batch_size: int, token_budget: int) -> List[List[tuple]]:
+    """Жадная упаковка подготовленных страниц в пакеты; страница больше бюджета уходит отдельным вызовом"""
+    batches, current, used = [], [], 0
+    for url, content in pages:
+        tokens = count_tokens(content)
+        if current and (len(current) >= batch_size or used + tokens > token_budget):
+            batches.append(current)
+            current, used = [], 0
+        current.append((url, content))
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+async def summarize_content(question: str, search_results: List[Dict], use_cache: bool = True) -> List[ContentSummary]:
     """Суммаризация контента с StructuredOutput в параллельном режиме"""
-    tasks = []
-    for result in search_results:
-        url, content = result[0], result[1]
-        if content:
-            tasks.append(summarize_single_content(question, content, url))
+    pages = [(result[0], result[1]) for result in search_results if result[1]]
+    if SUMMARY_BATCH_SIZE > 1:
+        prepared = [(url, prepare_content(question, content)) for url, content in pages]
+        batches = pack_batches(prepared, SUMMARY_BATCH_SIZE, SUMMARY_BATCH_TOKEN_BUDGET)
+        results = await asyncio.gather(*[summarize_batch(question, batch, use_cache=use_cache) for batch in batches])
+        return [summary for batch in results for summary in batch]
+
+    tasks = [summarize_single_content(question, content, url, use_cache=use_cache) for url, content in pages]
     # Run all summary tasks concurrently
     summaries = await asyncio.gather(*tasks, return_exceptions=False)
     return summaries
 
 async def synthesize_answer(question: str, summaries: List[ContentSummary], mcq_options: List[int],
-                            request_id: int) -> Dict:
-    """Генерация финального ответа с StructuredOutput"""
-    chain = llm.with_structured_output(AnswerResponse)
+                            request_id: int, mirrors: Optional[Dict[str, List[str]]] = None,
+                            use_cache: bool = True) -> Dict:
+    """Генерация финального ответа с StructuredOutput; mirrors - URL страниц-дубликатов по URL источника"""
     try:
-        result = await chain.ainvoke([HumanMessage(
-            content=f"""
-Ты — senior fact-checker международного аналитического агентства. Твоя задача — проводить аудит информации 
-по строгому протоколу Due Diligence для финансовых отчетов. Твои решения влияют на стратегические решения компаний.
-
-Принципы работы:
-1. Режим «Нулевого доверия»: любое утверждение требует двойного подтверждения из источников
-2. Приоритет первичных данных: работа только с явно указанными фактами
-3. Протокол расхождений: автоматическое вето при любых противоречиях
-4. Документированная трассировка: каждая часть ответа должна иметь явную ссылку на источник
-
-Аналитический кейс:
-
-Вопрос: {question}
-
-Доступные варианты ответа: 
-{mcq_options}
-
-Релевантная информация из источников:
-{json.dumps([[s.source, s.summary] for s in summaries], indent=2)}
-
-Требования к анализу:
-1. Тщательно сравни каждое числовое значение, дату или точный факт из источников с вариантами ответов
-2. Выбор возможен ТОЛЬКО если есть точное совпадение формулировки в проверяемом источнике
-3. Запрещено делать предположения, интерполяции или выбирать "ближайший" вариант
-4. Если несколько источников противоречат друг другу - вернуть null
-5. Если информация отсутствует/неполная/неоднозначная - вернуть null
-
-Шаги формирования ответа:
-"Анализ": 
-[
-"Поиск точных соответствий для каждого варианта в источниках",
-"Проверка противоречий между источниками",
-"Оценка полноты информации"
-],
-
-"Выбор опции": "ТОЛЬКО номер варианта при 100% совпадении",
-"Выбор источников, с которых взят ответ": "Цитата из источника с подтверждением",
-"is_answer_clear": True или False - твоя уверенность в ответе,
-"""
-        )])
+        with span('synthesize'):
+            result = await llm_cache.invoke(get_llm(), AnswerResponse, [SYNTHESIS_INSTRUCTIONS, HumanMessage(
+                content=synthesis_input.format(
+                    question=question, mcq_options=mcq_options,
+                    summaries=json.dumps([[s.source, s.summary] for s in summaries], indent=2)))],
+                use_cache=use_cache, priority=PRIORITY_HIGH)
         result.id = request_id
+        if mirrors:
+            # Дубликаты источника (зеркала, перепечатки) тоже подтверждают ответ
+            result.sources = list(dict.fromkeys(
+                result.sources + [mirror for source in result.sources for mirror in mirrors.get(source, ())]))
         result.sources = result.sources[:3]  # Ограничиваем количество источников
         return result.model_dump()
 
@@ -222,60 +498,512 @@ async def synthesize_answer(question: str, summaries: List[ContentSummary], mcq_
             sources=[]
         ).model_dump()
 
+def new_option_matcher(question: str) -> Optional[OptionMatcher]:
+    """Матчер вариантов ответа для одного прохода поиска, если вопрос ему подходит"""
+    if not EXTRACTIVE_MATCHING:
+        return None
+    matcher = OptionMatcher(question, min_sources=EXTRACTIVE_MIN_SOURCES, min_context=EXTRACTIVE_MIN_CONTEXT)
+    return matcher if matcher.usable else None
+
+def extractive_answer(matcher: Optional[OptionMatcher], request_id: int) -> Optional[Dict]:
+    """Уверенный ответ по дословным совпадениям вариантов со страницами или None"""
+    decision = matcher.decide() if matcher is not None else None
+    if decision is None:
+        return None
+    option, urls = decision
+    return AnswerResponse(
+        id=request_id,
+        answer=option,
+        reasoning=f"Вариант {option} («{matcher.options[option]}») дословно встречается в источниках ({len(urls)}) "
+                  f"рядом с ключевыми словами вопроса, остальные варианты в источниках не найдены",
+        is_answer_clear=True,
+        sources=urls[:3],
+    ).model_dump()
+
 # =====================
-# Main Flow
+# Warmup
 # =====================
 
-async def answer_mcq(input_data: dict) -> Dict:
-    question = input_data.get("query", "")
-    request_id = input_data.get("id", 0)
+STRUCTURED_SCHEMAS = (SearchQuery, SearchQueries, ContentSummary, BatchContentSummary, AnswerResponse)
+STATIC_PROMPTS = (RELEVANT_SEARCH_QUERY, EDIT_SEARCH_QUERY, DIVERSE_SEARCH_QUERIES, SUMMARY_BY_QUESTION,
+                  BATCH_SUMMARY_BY_QUESTION, SYNTHESIS_INSTRUCTIONS)
 
-    # Валидация формата вопроса
-    mcq_options = validate_mcq(question)
-    if not mcq_options:
-        return AnswerResponse(
-            id=request_id,
-            answer=None,
-            reasoning="Некорректный формат вопроса с вариантами ответов",
-            is_answer_clear=False,
-            sources=[]
-        ).model_dump()
 
-    try:
-        search_query = ''
-        for count in range(4):
-            # Генерация поискового запроса
-            if not search_query:
-                search_query = await generate_search_query(question)
-            else:
-                search_query = await regenerate_search_query(question, search_query)
+def preload_shared():
+    """Прогрев без сетевых клиентов, безопасный до fork: тяжёлые импорты, токенизатор, размеры статических
+    промптов и JSON-схемы. В мастере gunicorn --preload результат достаётся воркерам через copy-on-write"""
+    import openai  # noqa: F401
+    import langchain_openai  # noqa: F401
 
-            print("Current search query:", search_query)
+    for message in STATIC_PROMPTS:
+        count_static_tokens(message.content)
+    for schema in STRUCTURED_SCHEMAS:
+        schema_json(schema)
 
-            # Получение данных (предполагается, что get_clean_pages_texts уже оптимизирован для асинхронного вызова)
-            search_results = await get_clean_pages_texts(search_query)
 
-            # Параллельная суммаризация результатов
-            summaries = await summarize_content(question, search_results)
+async def warmup():
+    """Прогрев воркера после fork: клиент OpenAI, structured-output цепочки и HTTP-пул"""
+    # Импорты и токенизатор блокируют, поэтому в потоке; после preload они уже выполнены
+    await asyncio.to_thread(preload_shared)
+    llm = get_llm()
+    for schema in STRUCTURED_SCHEMAS:
+        llm_cache.chain(llm, schema)
+    await start_http_client()
 
-            # Синтез ответа
-            answer = await synthesize_answer(question, summaries, mcq_options, request_id)
+# =====================
+# Retrieval Pipeline
+# =====================
 
+class EvidenceStore:
+    """Саммари по URL, накопленные за все итерации одного запроса"""
+
+    def __init__(self):
+        self.summaries: Dict[str, ContentSummary] = {}
+        self.failed: set = set()
+        self.mirrors: Dict[str, List[str]] = {}
+        # Лучший ответ синтеза на случай, если срок запроса истечёт раньше ясного ответа
+        self.best: Optional[Dict] = None
+        self.iterations = 0
+        self.urls_skipped = 0
+        self.summaries_reused = 0
+
+    @property
+    def seen(self) -> set:
+        return set(self.summaries) | self.failed | {url for urls in self.mirrors.values() for url in urls}
+
+    def add(self, summary: ContentSummary):
+        # Ошибки суммаризации не считаются доказательством, такую страницу можно обработать ещё раз
+        if summary.coT != ["Ошибка"]:
+            self.summaries[summary.source] = summary
+
+    def offer(self, answer: Optional[Dict]):
+        if answer is not None and (self.best is None or score_answer(answer) >= score_answer(self.best)):
+            self.best = answer
+
+    def record_pages(self, result: PagesResult):
+        self.failed.update(result.failed)
+        self.mirrors = merge_mirrors(self.mirrors, result.duplicates)
+        self.urls_skipped += len(result.excluded)
+
+    def for_synthesis(self, question: str, fresh: List[ContentSummary]) -> List[ContentSummary]:
+        """Новые саммари плюс самые релевантные вопросу из прошлых итераций"""
+        fresh_sources = {summary.source for summary in fresh}
+        older = [summary for url, summary in self.summaries.items() if url not in fresh_sources]
+        room = EVIDENCE_MAX_SUMMARIES - len(fresh)
+        if not older or room <= 0:
+            return list(fresh)
+        scores = bm25_scores([summary.summary for summary in older], question)
+        best = [older[i] for i in np.argsort(-scores, kind='stable')[:room]]
+        self.summaries_reused += len(best)
+        return list(fresh) + best
+
+    def report(self) -> Dict:
+        evidence_stats['requests'] += 1
+        evidence_stats['iterations'] += self.iterations
+        evidence_stats['urls_skipped'] += self.urls_skipped
+        evidence_stats['summaries_reused'] += self.summaries_reused
+        return {'iterations': self.iterations, 'summaries': len(self.summaries),
+                'urls_skipped': self.urls_skipped, 'summaries_reused': self.summaries_reused}
+
+
+def synthesis_mirrors(evidence: Optional[EvidenceStore], pages: PagesResult) -> Dict[str, List[str]]:
+    return merge_mirrors(evidence.mirrors, pages.duplicates) if evidence is not None else pages.duplicates
+
+
+def record_collapsed(pages: PagesResult):
+    """Учёт вызовов суммаризации и токенов, которые не потрачены на страницы-дубликаты"""
+    for url, content in pages:
+        mirrors = pages.duplicates.get(url)
+        if mirrors:
+            # Дубликат ушёл бы в LLM в том же объёме, что и оставленная страница, вместе с шаблоном промпта
+            if PASSAGE_RANKING:
+                tokens = min(count_tokens(content), PASSAGE_TOKEN_BUDGET)
+            else:
+                tokens = count_tokens(content[:5000])
+            tokens += count_static_tokens(summary_by_question)
+            record_saved(len(mirrors), len(mirrors) * tokens)
+
+
+def with_evidence(evidence: Optional[EvidenceStore], question: str, summaries: List[ContentSummary]) -> List[ContentSummary]:
+    return evidence.for_synthesis(question, summaries) if evidence is not None else list(summaries)
+
+
+class StageTimer:
+    """Интервалы работы этапов одного прохода поиск → суммаризация → синтез"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {'fetch': [None, None], 'summarize': [None, None], 'synthesize': 0.0}
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        span = self.spans[stage]
+        if span[0] is None:
+            span[0] = now
+        span[1] = now
+
+    async def synthesize(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await synthesize_answer(*args, **kwargs)
+        finally:
+            self.spans['synthesize'] += time.perf_counter() - started
+
+    def record(self):
+        wall = time.perf_counter() - self.started
+        fetch = self.spans['fetch'][1] - self.started if self.spans['fetch'][1] else 0.0
+        summarize_start, summarize_end = self.spans['summarize']
+        summarize = summarize_end - summarize_start if summarize_start else 0.0
+        synthesize = self.spans['synthesize']
+        pipeline_stats['runs'] += 1
+        pipeline_stats['wall_seconds'] += wall
+        pipeline_stats['fetch_seconds'] += fetch
+        pipeline_stats['summarize_seconds'] += summarize
+        pipeline_stats['synthesize_seconds'] += synthesize
+        pipeline_stats['overlap_seconds'] += max(fetch + summarize + synthesize - wall, 0.0)
+
+
+async def staged_answer(question: str, search_query: str, mcq_options: List[int], request_id: int,
+                        use_cache: bool = True, evidence: Optional[EvidenceStore] = None) -> Dict:
+    """Поиск, суммаризация и синтез строго друг за другом"""
+    timer = StageTimer()
+    search_results = await get_clean_pages_texts(search_query, use_cache=use_cache, max_length=PAGE_TEXT_LENGTH,
+                                                 exclude=evidence.seen if evidence is not None else None)
+    timer.mark('fetch')
+    record_collapsed(search_results)
+    if evidence is not None:
+        evidence.record_pages(search_results)
+
+    matcher = new_option_matcher(question)
+    if matcher is not None:
+        for url, content in search_results:
+            matcher.add_page(url, content)
+        answer = extractive_answer(matcher, request_id)
+        if answer is not None:
+            pipeline_stats['extractive_answers'] += 1
+            timer.record()
+            return answer
+
+    timer.mark('summarize')
+    summaries = await summarize_content(question, search_results, use_cache=use_cache)
+    timer.mark('summarize')
+    if evidence is not None:
+        for summary in summaries:
+            evidence.add(summary)
+
+    answer = await timer.synthesize(question, with_evidence(evidence, question, summaries), mcq_options, request_id,
+                                    mirrors=synthesis_mirrors(evidence, search_results), use_cache=use_cache)
+    timer.record()
+    return answer
+
+
+async def pipelined_answer(question: str, search_query: str, mcq_options: List[int], request_id: int,
+                           use_cache: bool = True, evidence: Optional[EvidenceStore] = None) -> Dict:
+    """Каждая страница уходит в суммаризацию сразу после загрузки, синтез стартует после кворума саммари"""
+    timer = StageTimer()
+    finished = asyncio.Queue()
+    summary_tasks = []
+    buffered = []
+    submitted = 0
+    matcher = new_option_matcher(question)
+    pages_result = PagesResult()
+
+    async def summarize_pages(pages: List[tuple]):
+        timer.mark('summarize')
+        if SUMMARY_BATCH_SIZE > 1:
+            summaries = await summarize_batch(question, pages, use_cache=use_cache)
+        else:
+            summaries = [await summarize_single_content(question, pages[0][1], pages[0][0], prepared=True,
+                                                        use_cache=use_cache)]
+        timer.mark('summarize')
+        for summary in summaries:
+            finished.put_nowait(summary)
+
+    def submit_buffered():
+        nonlocal submitted
+        for batch in pack_batches(buffered, max(SUMMARY_BATCH_SIZE, 1), SUMMARY_BATCH_TOKEN_BUDGET):
+            submitted += len(batch)
+            summary_tasks.append(asyncio.ensure_future(summarize_pages(batch)))
+        buffered.clear()
+
+    async def fetch_pages():
+        try:
+            async with aclosing(iter_clean_pages_texts(search_query, use_cache=use_cache, max_length=PAGE_TEXT_LENGTH,
+                                                      result=pages_result,
+                                                      exclude=evidence.seen if evidence is not None else None)) as pages:
+                async for url, content in pages:
+                    timer.mark('fetch')
+                    if content:
+                        if matcher is not None:
+                            matcher.add_page(url, content)
+                        buffered.append((url, prepare_content(question, content)))
+                        if len(buffered) >= SUMMARY_BATCH_SIZE:
+                            submit_buffered()
+            if buffered:
+                submit_buffered()
+        finally:
+            record_collapsed(pages_result)
+            if evidence is not None:
+                evidence.record_pages(pages_result)
+            finished.put_nowait(None)
+
+    producer = asyncio.ensure_future(fetch_pages())
+    try:
+        summaries = []
+        fetching = True
+        answer, synthesized = None, -1
+        while fetching or len(summaries) < submitted:
+            summary = await finished.get()
+            if summary is None:
+                fetching = False
+                # Пробрасываем ошибку загрузки, если она была (например, ошибка Yandex API)
+                await producer
+                # Все страницы получены: если вариант ответа однозначно найден дословно, LLM больше не нужен,
+                # ещё не готовые саммари отменяются
+                extracted = extractive_answer(matcher, request_id)
+                if extracted is not None:
+                    pipeline_stats['extractive_answers'] += 1
+                    pipeline_stats['cancelled_summaries'] += sum(not t.done() for t in summary_tasks)
+                    return extracted
+                continue
+            summaries.append(summary)
+            if evidence is not None:
+                evidence.add(summary)
+
+            outstanding = fetching or len(summaries) < submitted
+            if synthesized < 0 and outstanding and len(summaries) >= SYNTHESIS_QUORUM:
+                answer = await timer.synthesize(question, with_evidence(evidence, question, summaries),
+                                                mcq_options, request_id,
+                                                mirrors=synthesis_mirrors(evidence, pages_result), use_cache=use_cache)
+                synthesized = len(summaries)
+                if evidence is not None:
+                    evidence.offer(answer)
+                if answer.get("is_answer_clear"):
+                    pipeline_stats['early_answers'] += 1
+                    pipeline_stats['cancelled_summaries'] += sum(not t.done() for t in summary_tasks)
+                    return answer
+
+        if synthesized != len(summaries):
+            answer = await timer.synthesize(question, with_evidence(evidence, question, summaries),
+                                            mcq_options, request_id, mirrors=synthesis_mirrors(evidence, pages_result),
+                                            use_cache=use_cache)
+        return answer
+    finally:
+        producer.cancel()
+        for task in summary_tasks:
+            task.cancel()
+        await asyncio.gather(producer, *summary_tasks, return_exceptions=True)
+        timer.record()
+
+
+async def snippet_answer(question: str, search_query: str, mcq_options: List[int], request_id: int,
+                         use_cache: bool = True, evidence: Optional[EvidenceStore] = None) -> Optional[Dict]:
+    """Ответ только по сниппетам выдачи; None, если сниппетов нет или ответ не ясен.
+
+    Неясный ответ тоже запоминается в evidence: он будет отдан, если срок запроса истечёт раньше.
+    """
+    # Если запрос закрывается локальным индексом (без уже обработанных страниц), в Yandex не ходим вовсе
+    if await search_local_pages(search_query, use_cache=use_cache, record=False,
+                                exclude=evidence.seen if evidence is not None else None):
+        return None
+    with span('snippets'):
+        snippets = await get_search_snippets(search_query, max_results=SNIPPET_MAX_RESULTS, use_cache=use_cache)
+    if not snippets:
+        return None
+    snippet_stats['attempts'] += 1
+    # Сниппеты зеркал одной страницы не должны считаться независимыми источниками
+    snippets, mirrors = collapse_duplicate_snippets(snippets)
+
+    matcher = new_option_matcher(question)
+    if matcher is not None:
+        for url, text in snippets:
+            matcher.add_page(url, text)
+        answer = extractive_answer(matcher, request_id)
+        if answer is not None:
+            snippet_stats['extractive_answers'] += 1
+            if evidence is not None:
+                evidence.offer(answer)
+            return answer
+
+    summaries = [ContentSummary(coT=[], summary=text, source=url) for url, text in snippets]
+    answer = await synthesize_answer(question, summaries, mcq_options, request_id, mirrors=mirrors,
+                                     use_cache=use_cache)
+    if evidence is not None:
+        # Без ссылок от модели источником неясного ответа считаются сами сниппеты
+        evidence.offer({**answer, 'sources': answer.get('sources') or [url for url, _ in snippets][:3]})
+    if answer.get("is_answer_clear"):
+        snippet_stats['llm_answers'] += 1
+        return answer
+    snippet_stats['unclear'] += 1
+    return None
+
+
+async def answer_from_search(question: str, search_query: str, mcq_options: List[int], request_id: int,
+                             use_cache: bool = True, evidence: Optional[EvidenceStore] = None) -> Dict:
+    if evidence is not None:
+        evidence.iterations += 1
+    if SNIPPET_FIRST:
+        answer = await snippet_answer(question, search_query, mcq_options, request_id, use_cache=use_cache,
+                                      evidence=evidence)
+        if answer is not None:
+            return answer
+    if PIPELINE_MODE == 'staged':
+        answer = await staged_answer(question, search_query, mcq_options, request_id, use_cache=use_cache,
+                                     evidence=evidence)
+    else:
+        answer = await pipelined_answer(question, search_query, mcq_options, request_id, use_cache=use_cache,
+                                        evidence=evidence)
+    if evidence is not None:
+        evidence.offer(answer)
+    return answer
+
+def score_answer(answer: Dict) -> float:
+    """Оценка ветки: ясный ответ важнее выбранного варианта, затем число подтверждающих источников"""
+    return 2.0 * bool(answer.get("is_answer_clear")) + (answer.get("answer") is not None) \
+        + 0.1 * min(len(answer.get("sources") or []), 3)
+
+
+async def speculative_answer(question: str, mcq_options: List[int], request_id: int,
+                             use_cache: bool = True, evidence: Optional[EvidenceStore] = None) -> Dict:
+    """Параллельные ветки поиска по разным запросам, первый ясный ответ побеждает"""
+    with span('query_generation'):
+        search_queries = await generate_search_queries(question, SPECULATIVE_BRANCHES, use_cache=use_cache)
+        if not search_queries:
+            search_queries = [await generate_search_query(question, use_cache=use_cache)]
+    logger.debug(f"Speculative search queries for request {request_id}: {search_queries}")
+
+    semaphore = asyncio.Semaphore(SPECULATIVE_MAX_CONCURRENCY)
+    speculative_stats['runs'] += 1
+    started = 0
+
+    async def branch(search_query: str, index: int) -> Dict:
+        nonlocal started
+        # Все ветки, кроме первой, спекулятивные: их вызовы LLM и поиска уступают основной работе
+        if index > 0:
+            current_priority.set(PRIORITY_LOW)
+        async with semaphore:
+            started += 1
+            speculative_stats['branches_started'] += 1
+            return await answer_from_search(question, search_query, mcq_options, request_id, use_cache=use_cache,
+                                            evidence=evidence)
+
+    branches = [asyncio.ensure_future(branch(query, index)) for index, query in enumerate(search_queries)]
+    best, error = None, None
+    try:
+        for next_finished in asyncio.as_completed(branches):
+            try:
+                answer = await next_finished
+            except Exception as e:
+                error = e
+                continue
+            if best is None or score_answer(answer) > score_answer(best):
+                best = answer
             if answer.get("is_answer_clear"):
-                return answer  # Ранний выход если ответ ясен
+                speculative_stats['clear_answers'] += 1
+                return answer
+    finally:
+        for task in branches:
+            if not task.done():
+                task.cancel()
+                speculative_stats['branches_cancelled'] += 1
+        await asyncio.gather(*branches, return_exceptions=True)
+        ITERATIONS.observe(started)
+
+    if best is None:
+        raise error
+    return best
 
-        # Если ни одна итерация не дала ясный ответ, возвращаем последний результат
-        return answer
+# =====================
+# Main Flow
+# =====================
 
-    except Exception as e:
+def expired_answer(evidence: EvidenceStore, request_id: int) -> Dict:
+    """Ответ по истечении срока запроса: лучший из уже полученных или пустой"""
+    deadline_stats['expired'] += 1
+    if evidence.best is not None:
+        deadline_stats['degraded_answers'] += 1
+        return {**evidence.best, 'id': request_id, 'is_answer_clear': False,
+                'reasoning': "Срок обработки запроса истёк, ответ по неполным данным. " + evidence.best['reasoning']}
+    deadline_stats['empty_answers'] += 1
+    return AnswerResponse(
+        id=request_id,
+        answer=None,
+        reasoning="Срок обработки запроса истёк до получения ответа",
+        is_answer_clear=False,
+        sources=[]
+    ).model_dump()
+
+async def answer_mcq(input_data: dict) -> Dict:
+    question = input_data.get("query", "")
+    request_id = input_data.get("id", 0)
+    use_cache = input_data.get("use_cache", True)
+    timeout = input_data.get("timeout") or REQUEST_TIMEOUT
+
+    # Валидация формата вопроса
+    mcq_options = validate_mcq(question)
+    if not mcq_options:
         return AnswerResponse(
             id=request_id,
             answer=None,
-            reasoning=f"Ошибка обработки: {str(e)}",
+            reasoning="Некорректный формат вопроса с вариантами ответов",
             is_answer_clear=False,
             sources=[]
         ).model_dump()
 
+    # Один поиск и одна загрузка страницы на запрос: сниппеты и страницы используют одну выдачу,
+    # даже когда кэш отключён. Внутри пакета /api/batch незавершённые загрузки ещё и общие для всего пакета
+    scope_token = shared_work.set(SingleFlight(keep_results=True, parent=shared_work.get()))
+    evidence = EvidenceStore()
+    deadline_stats['requests'] += 1
+    with deadline_after(timeout):
+        try:
+            async with timeout_scope():
+                if SPECULATIVE_BRANCHES > 1:
+                    return await speculative_answer(question, mcq_options, request_id, use_cache=use_cache,
+                                                    evidence=evidence)
+
+                search_query = ''
+                for count in range(4):
+                    # Генерация поискового запроса
+                    with span('query_generation'):
+                        if not search_query:
+                            search_query = await generate_search_query(question, use_cache=use_cache)
+                        else:
+                            search_query = await regenerate_search_query(question, search_query,
+                                                                         use_cache=use_cache)
+
+                    print("Current search query:", search_query)
+
+                    # Получение данных, суммаризация и синтез ответа
+                    answer = await answer_from_search(question, search_query, mcq_options, request_id,
+                                                      use_cache=use_cache, evidence=evidence)
+
+                    if answer.get("is_answer_clear"):
+                        ITERATIONS.observe(count + 1)
+                        return answer  # Ранний выход если ответ ясен
+
+                # Если ни одна итерация не дала ясный ответ, возвращаем последний результат
+                ITERATIONS.observe(count + 1)
+                return answer
+
+        except Overloaded:
+            # Перегрузку LLM или поиска клиент должен получить сразу как 429/503 с Retry-After
+            raise
+        except Exception as e:
+            # Срок истёк: незавершённая работа запроса уже отменена, отдаём лучшее из полученного
+            if isinstance(e, TimeoutError) and deadline_passed():
+                return expired_answer(evidence, request_id)
+            return AnswerResponse(
+                id=request_id,
+                answer=None,
+                reasoning=f"Ошибка обработки: {str(e)}",
+                is_answer_clear=False,
+                sources=[]
+            ).model_dump()
+        finally:
+            logger.debug(f"Evidence reuse for request {request_id}: {evidence.report()}")
+            shared_work.reset(scope_token)
+
 async def main():
     sample_input = {
         "query": "На какие даты приходится проведение основного этапа МегаШколы ИТМО в январе 2025 года?\n1. 11-13\n2. 23-25\n3. 28-30\n4. 29-31",
@@ -1,19 +1,128 @@
 import asyncio
+import math
+from contextlib import aclosing
+from contextvars import ContextVar
 import aiohttp
+import lxml.etree
 import lxml.html
 import xml.etree.ElementTree as ET
 import re
 import os
 from dotenv import load_dotenv
+from utils.cache import TieredCache
+from utils.deadline import budget, remaining
+from utils.http_client import get_http_client
+from utils.local_index import LocalIndex
+from utils.metrics import FETCH_FAILURES, span
+from utils.near_duplicates import NearDuplicateFilter
+from utils.page_cache import PageCache
+from utils.parse_pool import ParseExecutor
+from utils.scheduler import UpstreamScheduler
 
 load_dotenv()
 
+# Search results cache, the SQLite tier is shared by all gunicorn workers
+search_cache = TieredCache(
+    'search_results',
+    maxsize=int(os.getenv('SEARCH_CACHE_SIZE', 512)),
+    ttl=float(os.getenv('SEARCH_CACHE_TTL', 6 * 3600)),
+    path=os.getenv('SEARCH_CACHE_PATH', 'cache/search.sqlite') or None,
+    disk_maxsize=int(os.getenv('SEARCH_CACHE_DISK_SIZE', 20000)),
+)
+
+# Cleaned page texts, revalidated with conditional GETs once they go stale
+page_cache = PageCache(
+    max_bytes=int(os.getenv('PAGE_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    fresh_ttl=float(os.getenv('PAGE_CACHE_FRESH_TTL', 600)),
+    ttl=float(os.getenv('PAGE_CACHE_TTL', 7 * 24 * 3600)),
+    path=os.getenv('PAGE_CACHE_PATH') or None,
+)
+
+YANDEX_SEARCH_URL = os.getenv('YANDEX_SEARCH_URL', 'https://yandex.ru/search/xml')
+
+# Local full-text index of every fetched page, queried before Yandex: when at least LOCAL_INDEX_MIN_PAGES
+# indexed pages cover LOCAL_INDEX_MIN_COVERAGE of the query terms, the web is not touched at all
+LOCAL_INDEX_PATH = os.getenv('LOCAL_INDEX_PATH', 'cache/pages_index.sqlite')
+LOCAL_INDEX_FIRST = os.getenv('LOCAL_INDEX_FIRST', '1') == '1'
+LOCAL_INDEX_MIN_PAGES = int(os.getenv('LOCAL_INDEX_MIN_PAGES', 3))
+LOCAL_INDEX_MIN_COVERAGE = float(os.getenv('LOCAL_INDEX_MIN_COVERAGE', 0.7))
+# Pages not refreshed from the web for this many seconds are no longer served from the index, 0 keeps them forever
+LOCAL_INDEX_MAX_AGE = float(os.getenv('LOCAL_INDEX_MAX_AGE', 7 * 24 * 3600))
+local_index = LocalIndex(LOCAL_INDEX_PATH, max_age=LOCAL_INDEX_MAX_AGE) if LOCAL_INDEX_PATH else None
+
+# Yandex XML calls go through a scheduler: per-worker rate limit, bounded queue, retries on 429/5xx
+search_scheduler = UpstreamScheduler(
+    'yandex_search',
+    requests_per_minute=float(os.getenv('SEARCH_RPM', 300)),
+    max_concurrency=int(os.getenv('SEARCH_MAX_CONCURRENCY', 8)),
+    max_queue=int(os.getenv('SEARCH_MAX_QUEUE', 128)),
+    max_retries=int(os.getenv('UPSTREAM_MAX_RETRIES', 4)),
+    retry_exceptions=(asyncio.TimeoutError, aiohttp.ClientConnectionError),
+)
+
+# 'stream' reads pages in chunks under FETCH_MAX_BYTES and stops once enough text is parsed,
+# 'buffered' downloads the whole body and parses it at once
+FETCH_MODE = os.getenv('FETCH_MODE', 'stream')
+FETCH_MAX_BYTES = int(os.getenv('FETCH_MAX_BYTES', 2 * 1024 * 1024))
+FETCH_CHUNK_SIZE = int(os.getenv('FETCH_CHUNK_SIZE', 16 * 1024))
+
+# Hedging against slow hosts: fetch SEARCH_OVERFETCH_FACTOR times more URLs than needed and stop
+# at max_results good pages or after SEARCH_SOFT_DEADLINE seconds, cancelling the stragglers
+SEARCH_OVERFETCH_FACTOR = float(os.getenv('SEARCH_OVERFETCH_FACTOR', 1.0))
+SEARCH_SOFT_DEADLINE = float(os.getenv('SEARCH_SOFT_DEADLINE', 0)) or None
+# Under a request deadline page fetching stops this many seconds (at most half of the time left) before it,
+# leaving time for the LLM stages
+SEARCH_DEADLINE_RESERVE = float(os.getenv('SEARCH_DEADLINE_RESERVE', 10))
+
+# Mirrors and syndicated copies: a page whose MinHash similarity to an earlier page of the same search
+# is at least NEAR_DUPLICATE_THRESHOLD is not returned, its URL is kept as a mirror of that page; 0 disables
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv('NEAR_DUPLICATE_THRESHOLD', 0.8))
+
+HTML_CONTENT_TYPES = {'text/html', 'application/xhtml+xml', 'text/plain'}
+SKIPPED_TAGS = {'script', 'style', 'meta', 'link', 'head', 'noscript', 'button', 'footer', 'form', 'iframe'}
+
 # Precompile all regex patterns
 MULTI_NEWLINES = re.compile(r'\n{3,}')
 MULTI_SPACES = re.compile(r'[ \t\f\r]{2,}')
 UNWANTED_NEWLINES = re.compile(r'\n\s*\n')
 NON_BREAKING_SPACE = re.compile(r'\xa0')
 CLEAN_NEWLINES = re.compile(r'\n')
+QUERY_PUNCTUATION = re.compile(r'[^\w\s-]+')
+QUERY_SPACES = re.compile(r'\s+')
+# <meta charset=...> and <meta http-equiv="Content-Type" content="...; charset=...">
+META_CHARSET = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', re.IGNORECASE)
+# A streamed page is held back until this many bytes are in, to find its <meta> charset
+META_SNIFF_BYTES = 1024
+
+
+# Set per request, and per batch for in-flight work: identical searches and page fetches inside are done once
+shared_work: ContextVar = ContextVar('shared_work', default=None)
+
+fetch_stats = {'requests': 0, 'local_requests': 0, 'excluded': 0, 'pages': 0, 'duplicates': 0, 'failed': 0, 'cancelled': 0,
+               'dropped_for_latency': 0}
+
+
+class PagesResult(list):
+    """(url, text) pairs in search rank order, plus the URLs that didn't make it"""
+
+    def __init__(self, pages=(), failed=(), cancelled=(), dropped_for_latency=(), excluded=()):
+        super().__init__(pages)
+        self.ranks = {}
+        # Near-duplicate URLs collapsed into a returned page, by that page's URL
+        self.duplicates = {}
+        self.failed = list(failed)
+        # Skipped because the caller already processed them
+        self.excluded = list(excluded)
+        # Still in flight when max_results pages had already arrived
+        self.cancelled = list(cancelled)
+        # Still in flight when the soft deadline passed
+        self.dropped_for_latency = list(dropped_for_latency)
+
+
+def normalize_query(query):
+    """Normalize a search query so near-identical queries share a cache key"""
+    query = QUERY_PUNCTUATION.sub(' ', query.lower().replace('ё', 'е'))
+    return QUERY_SPACES.sub(' ', query).strip()
 
 
 def extract_clean_text_lxml(html):
@@ -25,47 +134,261 @@ def extract_clean_text_lxml(html):
         elem.getparent().remove(elem)
 
     # Extract text
-    text = tree.text_content()
+    return clean_extracted_text(tree.text_content())
+
 
-    # Apply optimized regex cleaning
+def clean_extracted_text(text):
+    """Apply optimized regex cleaning"""
     text = MULTI_NEWLINES.sub('\n\n', text)
     text = MULTI_SPACES.sub(' ', text)
     text = NON_BREAKING_SPACE.sub(' ', text)
     return text.strip()
 
 
-async def fetch_page_html(session, url):
-    """Fetch HTML asynchronously with optimized timeouts"""
+class VisibleTextCollector:
+    """lxml parser target that keeps text outside of SKIPPED_TAGS, fed chunk by chunk"""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+        self._skip_depth = 0
+
+    def start(self, tag, attrib):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth += 1
+
+    def end(self, tag):
+        if tag in SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+            self.size += len(data)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        return ''.join(self.parts)
+
+
+def is_html_response(response):
+    # aiohttp reports a missing Content-Type as application/octet-stream
+    if 'Content-Type' not in response.headers or response.content_type in HTML_CONTENT_TYPES:
+        return True
+    FETCH_FAILURES.labels('content_type').inc()
+    return False
+
+
+def fetch_failure_reason(error):
+    if isinstance(error, asyncio.TimeoutError):
+        return 'timeout'
+    if isinstance(error, aiohttp.ClientResponseError):
+        return f'http_{error.status}'
+    if isinstance(error, aiohttp.ClientError):
+        return 'connection'
+    return 'other'
+
+
+async def fetch_page_html(session, url, headers=None):
+    """Fetch HTML asynchronously with optimized timeouts.
+
+    Returns (status, html, final_url, etag, last_modified) or None on failure;
+    html is None for 304 Not Modified.
+    """
     try:
-        async with session.get(url, timeout=aiohttp.ClientTimeout(total=10),
-                               allow_redirects=True) as response:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=budget(10)),
+                               allow_redirects=True, headers=headers) as response:
+            if response.status == 304:
+                return 304, None, str(response.url), None, None
             response.raise_for_status()
-            return await response.text()
-    except Exception:
+            if not is_html_response(response):
+                return None
+            return (
+                response.status,
+                await response.text(),
+                str(response.url),
+                response.headers.get('ETag'),
+                response.headers.get('Last-Modified'),
+            )
+    except Exception as e:
+        FETCH_FAILURES.labels(fetch_failure_reason(e)).inc()
+        return None
+
+
+def collapse_newlines(text):
+    text = UNWANTED_NEWLINES.sub(' ', text)
+    return CLEAN_NEWLINES.sub(' ', text).strip()
+
+
+def clean_page_text(html):
+    """Extract text from HTML and collapse it into a single line"""
+    return collapse_newlines(extract_clean_text_lxml(html))
+
+
+def streaming_parser(collector, charset, head):
+    """Incremental HTML parser for raw bytes: the HTTP charset, else the <meta> one from head, else UTF-8"""
+    if not charset:
+        match = META_CHARSET.search(head)
+        charset = match.group(1).decode('ascii') if match else 'utf-8'
+    try:
+        return lxml.etree.HTMLParser(target=collector, encoding=charset)
+    except LookupError:
+        return lxml.etree.HTMLParser(target=collector, encoding='utf-8')
+
+
+async def fetch_page_text_streaming(session, url, max_length, headers=None):
+    """Stream the page through an incremental parser until max_length characters of text are ready.
+
+    Returns (status, text, final_url, etag, last_modified, complete) or None on failure;
+    text is None for 304 Not Modified, complete is False if the download was cut short.
+    """
+    try:
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=budget(10)),
+                               allow_redirects=True, headers=headers) as response:
+            if response.status == 304:
+                return 304, None, str(response.url), None, None, True
+            response.raise_for_status()
+            # Reject PDFs, images and other binaries before reading the body
+            if not is_html_response(response):
+                return None
+
+            collector = VisibleTextCollector()
+            parser = None
+            head = b''
+            received = 0
+            # Raw text only shrinks during cleaning, so the cleaned text is measured once the raw text
+            # passes this size, and then only after it doubles, keeping the checks linear in the page size
+            next_check = max_length
+            complete = True
+            async for chunk in response.content.iter_chunked(FETCH_CHUNK_SIZE):
+                received += len(chunk)
+                if parser is None:
+                    head += chunk
+                    if len(head) < META_SNIFF_BYTES:
+                        continue
+                    parser, chunk = streaming_parser(collector, response.charset, head), head
+                parser.feed(chunk)
+                if collector.size > next_check:
+                    if len(collapse_newlines(clean_extracted_text(''.join(collector.parts)))) > max_length:
+                        complete = False
+                        break
+                    next_check = collector.size * 2
+                if received >= FETCH_MAX_BYTES:
+                    complete = False
+                    break
+            if parser is None:
+                parser = streaming_parser(collector, response.charset, head)
+                parser.feed(head)
+            text = collapse_newlines(clean_extracted_text(parser.close()))
+            return (
+                response.status,
+                text,
+                str(response.url),
+                response.headers.get('ETag'),
+                response.headers.get('Last-Modified'),
+                complete,
+            )
+    except Exception as e:
+        FETCH_FAILURES.labels(fetch_failure_reason(e)).inc()
         return None
 
 
+# Big pages are parsed in a process pool so they don't stall the event loop. Streamed pages never reach
+# the pool: their parser keeps state between chunks, so it runs on the event loop one chunk
+# (FETCH_CHUNK_SIZE) at a time, and no pool is started in that mode
+parse_executor = ParseExecutor(
+    clean_page_text,
+    mode=os.getenv('PARSE_MODE', 'auto') if FETCH_MODE != 'stream' else 'inline',
+    inline_threshold=int(os.getenv('PARSE_INLINE_THRESHOLD', 200_000)),
+    workers=int(os.getenv('PARSE_WORKERS', 0)) or None,
+    batch_size=int(os.getenv('PARSE_BATCH_SIZE', 8)),
+    batch_delay=float(os.getenv('PARSE_BATCH_DELAY', 0.005)),
+)
+
+
+def trim_text(text, max_length):
+    return text[:max_length] + '...' if len(text) > max_length else text
+
+
 async def process_url(session, url, max_length=1000):
     """Process a single URL asynchronously"""
-    html = await fetch_page_html(session, url)
-    if not html:
+    scope = shared_work.get()
+    if scope is not None:
+        return await scope.do(('page', url, max_length), lambda: _process_url(session, url, max_length))
+    return await _process_url(session, url, max_length)
+
+
+async def _process_url(session, url, max_length):
+    cached = await page_cache.get(url)
+    # A truncated streamed entry is only usable if it holds enough text for this caller
+    if cached is not None and not cached.get('complete', True) and len(cached['text']) <= max_length:
+        cached = None
+    if cached is not None and page_cache.is_fresh(cached):
+        page_cache.record('fresh_hit')
+        return url, trim_text(cached['text'], max_length)
+
+    headers = page_cache.conditional_headers(cached)
+    with span('fetch'):
+        if FETCH_MODE == 'stream':
+            fetched = await fetch_page_text_streaming(session, url, max_length, headers=headers)
+        else:
+            fetched = await fetch_page_html(session, url, headers=headers)
+            if fetched:
+                fetched = (*fetched, True)
+    if not fetched:
         return None
+    status, body, final_url, etag, last_modified, complete = fetched
 
-    try:
-        clean_text = extract_clean_text_lxml(html)
-        clean_text = UNWANTED_NEWLINES.sub(' ', clean_text)
-        clean_text = CLEAN_NEWLINES.sub(' ', clean_text).strip()
-
-        return (
-            url, clean_text[:max_length] + '...' if len(clean_text) > max_length else clean_text
-        ) if clean_text else None
-    except Exception:
+    if status == 304:
+        if cached is None:
+            return None
+        page_cache.record('revalidated')
+        await page_cache.mark_validated(url, cached)
+        return url, trim_text(cached['text'], max_length)
+
+    if not body:
         return None
 
+    if FETCH_MODE == 'stream':
+        clean_text = body
+    else:
+        try:
+            with span('parse'):
+                clean_text = await parse_executor.run(body)
+        except Exception:
+            FETCH_FAILURES.labels('parse').inc()
+            return None
+    if not clean_text:
+        FETCH_FAILURES.labels('empty').inc()
+        return None
+
+    await page_cache.put(url, final_url, clean_text, etag, last_modified, complete=complete)
+    if local_index is not None:
+        local_index.add_later(final_url, clean_text)
+    return url, trim_text(clean_text, max_length)
+
 
-async def async_get_search_results(query, folder_id, api_key):
+async def async_get_search_results(query, folder_id, api_key, use_cache=True):
     """Async search request to Yandex XML API"""
-    base_url = 'https://yandex.ru/search/xml'
+    cache_key = normalize_query(query)
+    if use_cache:
+        content = await search_cache.get(cache_key)
+        if content is not None:
+            return ET.fromstring(content)
+
+    scope = shared_work.get()
+    if scope is not None:
+        content = await scope.do(('search', cache_key),
+                                 lambda: _request_search_xml(query, folder_id, api_key, cache_key))
+    else:
+        content = await _request_search_xml(query, folder_id, api_key, cache_key)
+    return ET.fromstring(content)
+
+
+async def _request_search_xml(query, folder_id, api_key, cache_key):
+    base_url = YANDEX_SEARCH_URL
     params = {
         'folderid': folder_id,
         'apikey': api_key,
@@ -74,30 +397,197 @@ async def async_get_search_results(query, folder_id, api_key):
         'groupby': 'attr=d.mode=deep.groups-on-page=10.docs-in-group=1'
     }
 
-    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15)) as session:
-        async with session.get(base_url, params=params) as response:
+    session = await get_http_client()
+
+    async def request():
+        async with session.get(base_url, params=params, timeout=aiohttp.ClientTimeout(total=budget(15))) as response:
             response.raise_for_status()
-            content = await response.text()
-            return ET.fromstring(content)
+            return await response.text()
+
+    with span('search'):
+        content = await search_scheduler.submit(request)
+    root = ET.fromstring(content)
+
+    # Yandex reports quota and query problems inside a 200 response, don't cache those
+    if root.find('.//error') is None:
+        await search_cache.set(cache_key, content)
+    return content
+
+
+def parse_search_results(root):
+    """Documents of a Yandex XML response in rank order: dicts with url, title and passages"""
+    docs = []
+    for doc in root.findall('.//group/doc'):
+        url = doc.findtext('url')
+        if not url:
+            continue
+        title = doc.find('title')
+        docs.append({
+            'url': url,
+            # Highlighted words come as nested <hlword> elements
+            'title': ''.join(title.itertext()).strip() if title is not None else '',
+            'passages': [''.join(passage.itertext()).strip() for passage in doc.findall('passages/passage')],
+        })
+    return docs
 
 
-async def get_clean_pages_texts(query, max_results=5):
-    """Fetch and process search results asynchronously"""
+async def search_local_pages(query, max_results=5, use_cache=True, record=True, exclude=None, result=None):
+    """Pages from the local index if it recalls enough of them for the query, otherwise an empty list.
+
+    URLs in exclude are dropped before deciding whether there are enough pages, and recorded in
+    result.excluded if result (a PagesResult) is given.
+    """
+    if local_index is None or not LOCAL_INDEX_FIRST or not use_cache:
+        return []
+    exclude = exclude or set()
+    with span('local_search'):
+        pages = await local_index.search_async(query, limit=max_results + len(exclude),
+                                               min_coverage=LOCAL_INDEX_MIN_COVERAGE)
+    new_pages = [(url, text) for url, text in pages if url not in exclude][:max_results]
+    enough = len(new_pages) >= LOCAL_INDEX_MIN_PAGES
+    if record:
+        local_index.record(enough)
+    if not enough:
+        return []
+    if result is not None:
+        result.excluded.extend(url for url, _ in pages if url in exclude)
+    return new_pages
+
+
+async def get_search_snippets(query, max_results=10, use_cache=True):
+    """(url, title and passages) of the search results, without fetching the pages"""
     folder_id = os.getenv('YANDEX_SEARCH_ID')
     api_key = os.getenv('YANDEX_SEARCH_SECRET')
-
-    root = await async_get_search_results(query, folder_id, api_key)
+    root = await async_get_search_results(query, folder_id, api_key, use_cache=use_cache)
     if not root:
         return []
+    snippets = []
+    for doc in parse_search_results(root)[:max_results]:
+        text = ' ... '.join(part for part in [doc['title'], *doc['passages']] if part)
+        if text:
+            snippets.append((doc['url'], text))
+    return snippets
+
+
+def collapse_duplicate_snippets(snippets):
+    """Snippets without near-duplicates of an earlier one, plus the URLs collapsed into each kept snippet"""
+    if NEAR_DUPLICATE_THRESHOLD <= 0:
+        return list(snippets), {}
+    duplicates = NearDuplicateFilter(NEAR_DUPLICATE_THRESHOLD)
+    kept, mirrors = [], {}
+    for url, text in snippets:
+        original = duplicates.add(url, text)
+        if original is None:
+            kept.append((url, text))
+        else:
+            mirrors.setdefault(original, []).append(url)
+    return kept, mirrors
+
+
+async def iter_clean_pages_texts(query, max_results=5, use_cache=True, overfetch=None, soft_deadline=None,
+                                 result=None, max_length=1000, exclude=None):
+    """Yield (url, text) pages as soon as each one is ready.
+
+    Up to max_results * overfetch URLs are fetched concurrently; once max_results pages are ready
+    or soft_deadline seconds have passed (at the latest SEARCH_DEADLINE_RESERVE seconds before the
+    request deadline) the rest is cancelled. URLs in exclude are skipped before fetching. Near-duplicates
+    of an already returned page are not yielded and don't count towards max_results. Pages and the URLs
+    that didn't make it are recorded in result (a PagesResult) if one is given.
+    """
+    folder_id = os.getenv('YANDEX_SEARCH_ID')
+    api_key = os.getenv('YANDEX_SEARCH_SECRET')
+    overfetch = SEARCH_OVERFETCH_FACTOR if overfetch is None else overfetch
+    soft_deadline = SEARCH_SOFT_DEADLINE if soft_deadline is None else soft_deadline
+    result = PagesResult() if result is None else result
+    exclude = exclude or set()
+    duplicates = NearDuplicateFilter(NEAR_DUPLICATE_THRESHOLD) if NEAR_DUPLICATE_THRESHOLD > 0 else None
+
+    async def is_duplicate(url, text):
+        if duplicates is None:
+            return False
+        kept = await asyncio.to_thread(duplicates.add, url, text)
+        if kept is not None:
+            result.duplicates.setdefault(kept, []).append(url)
+        return kept is not None
+
+    local_pages = await search_local_pages(query, max_results, use_cache=use_cache, exclude=exclude, result=result)
+    if local_pages:
+        fetch_stats['local_requests'] += 1
+        for rank, (url, text) in enumerate(local_pages):
+            text = trim_text(text, max_length)
+            if await is_duplicate(url, text):
+                continue
+            result.append((url, text))
+            result.ranks[url] = rank
+            yield result[-1]
+        return
+
+    root = await async_get_search_results(query, folder_id, api_key, use_cache=use_cache)
+    if not root:
+        return
+
+    urls = [doc['url'] for doc in parse_search_results(root)]
+    result.excluded.extend(url for url in urls if url in exclude)
+    urls = [url for url in urls if url not in exclude][:max(max_results, math.ceil(max_results * overfetch))]
+
+    session = await get_http_client()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + soft_deadline if soft_deadline else None
+    left = remaining()
+    if left is not None:
+        cutoff = loop.time() + max(left - min(SEARCH_DEADLINE_RESERVE, left / 2), 0)
+        deadline = cutoff if deadline is None else min(deadline, cutoff)
+    tasks = {asyncio.ensure_future(process_url(session, url, max_length)): rank for rank, url in enumerate(urls)}
+    pending = set(tasks)
+    deadline_hit = False
+    try:
+        while pending and len(result) < max_results:
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    deadline_hit = True
+                    break
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                deadline_hit = True
+                break
+            for task in sorted(done, key=tasks.get):
+                page = None if task.exception() else task.result()
+                if not page:
+                    result.failed.append(urls[tasks[task]])
+                elif len(result) < max_results and not await is_duplicate(*page):
+                    result.append(page)
+                    result.ranks[page[0]] = tasks[task]
+                    yield page
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        not_finished = [urls[tasks[task]] for task in sorted(pending, key=tasks.get)]
+        if deadline_hit:
+            result.dropped_for_latency.extend(not_finished)
+        else:
+            result.cancelled.extend(not_finished)
+        fetch_stats['requests'] += 1
+        fetch_stats['excluded'] += len(result.excluded)
+        fetch_stats['pages'] += len(result)
+        fetch_stats['duplicates'] += sum(len(mirrors) for mirrors in result.duplicates.values())
+        fetch_stats['failed'] += len(result.failed)
+        fetch_stats['cancelled'] += len(result.cancelled)
+        fetch_stats['dropped_for_latency'] += len(result.dropped_for_latency)
+
 
-    urls = [url.text for group in root.findall(".//group")
-            for url in group.findall("./doc/url")][:max_results]
-
-    connector = aiohttp.TCPConnector(limit_per_host=50)
-    async with aiohttp.ClientSession(
-            connector=connector,
-            headers={"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"}
-    ) as session:
-        tasks = [process_url(session, url) for url in urls]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        return [r for r in results if r and not isinstance(r, Exception)][:max_results]
+async def get_clean_pages_texts(query, max_results=5, use_cache=True, overfetch=None, soft_deadline=None,
+                                max_length=1000, exclude=None):
+    """Fetch and process search results asynchronously, pages are returned in search rank order"""
+    result = PagesResult()
+    async with aclosing(iter_clean_pages_texts(query, max_results=max_results, use_cache=use_cache,
+                                               overfetch=overfetch, soft_deadline=soft_deadline,
+                                               result=result, max_length=max_length, exclude=exclude)) as pages:
+        async for _ in pages:
+            pass
+    result.sort(key=lambda page: result.ranks[page[0]])
+    return result
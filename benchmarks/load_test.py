@@ -0,0 +1,329 @@
+"""Нагрузочный тест сервиса на локальных заглушках Yandex XML, веб-страниц и OpenAI.
+
+Поднимает benchmarks.stub_servers и gunicorn с main:app, гоняет /api/request с заданной
+параллельностью и печатает p50/p95/p99, запросы в секунду, CPU и память каждого воркера,
+а также сравнение с сохранённым базовым прогоном:
+
+    python -m benchmarks.load_test --concurrency 16 --requests 200 --save-baseline
+    python -m benchmarks.load_test --concurrency 16 --requests 200 --env SUMMARY_BATCH_SIZE=5
+
+Базовый прогон зависит от машины, поэтому сравнивать имеет смысл прогоны на одном и том же хосте.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from benchmarks.stub_servers import add_arguments
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+QUESTIONS = [
+    "В каком городе находится главный кампус Университета ИТМО?\n1. Москва\n2. Санкт-Петербург\n3. Екатеринбург\n4. Нижний Новгород",
+    "В каком году был основан Университет ИТМО?\n1. 1900\n2. 1930\n3. 1945\n4. 1991",
+    "Какой факультет ИТМО занимается фотоникой?\n1. ФТФ\n2. ФИТиП\n3. ФПИиКТ\n4. ФБИТ",
+    "Сколько раз команда ИТМО побеждала на ICPC?\n1. 3\n2. 5\n3. 7\n4. 9",
+    "На какой улице находится главное здание ИТМО?\n1. Кронверкский проспект\n2. Невский проспект\n3. Ломоносова\n4. Биржевая линия",
+    "Кто был ректором ИТМО в 2010 году?\n1. Васильев\n2. Нарышкин\n3. Бугаев\n4. Шехонин",
+]
+
+# Метрики, по которым прогон сравнивается с базовым: имя -> True, если больше значит лучше
+COMPARED = {'p50_s': False, 'p95_s': False, 'p99_s': False, 'rps': True, 'error_rate': False}
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def worker_pids(master_pid: int) -> list:
+    """Дочерние процессы gunicorn по /proc (Linux)"""
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == master_pid:
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def process_usage(pid: int) -> dict:
+    """Процессорное время (с) и резидентная память (МБ) процесса"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    with open(f'/proc/{pid}/status') as f:
+        status = dict(line.split(':', 1) for line in f if ':' in line)
+    return {
+        'cpu_s': (int(fields[11]) + int(fields[12])) / CLOCK_TICKS,
+        'rss_mb': int(status['VmRSS'].split()[0]) / 1024,
+        'peak_rss_mb': int(status.get('VmHWM', status['VmRSS']).split()[0]) / 1024,
+    }
+
+
+class ResourceSampler:
+    """Периодически снимает CPU и память воркеров, пока идёт нагрузка"""
+
+    def __init__(self, master_pid: int, interval: float = 0.5):
+        self.master_pid = master_pid
+        self.interval = interval
+        self.first, self.last = {}, {}
+        self.max_rss = {}
+
+    def sample(self):
+        for pid in worker_pids(self.master_pid):
+            try:
+                usage = process_usage(pid)
+            except (OSError, KeyError):
+                continue
+            self.first.setdefault(pid, usage)
+            self.last[pid] = usage
+            self.max_rss[pid] = max(self.max_rss.get(pid, 0.0), usage['rss_mb'])
+
+    async def run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def report(self, elapsed: float) -> list:
+        workers = []
+        for pid, last in self.last.items():
+            cpu = last['cpu_s'] - self.first[pid]['cpu_s']
+            workers.append({
+                'pid': pid,
+                'cpu_s': round(cpu, 3),
+                'cpu_percent': round(100 * cpu / elapsed, 1) if elapsed else 0.0,
+                'max_rss_mb': round(self.max_rss[pid], 1),
+                'peak_rss_mb': round(last['peak_rss_mb'], 1),
+            })
+        return workers
+
+
+async def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{process.args[0]} exited with code {process.returncode}")
+            try:
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=2)) as response:
+                    if response.status < 500:
+                        return
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up in {timeout}s")
+
+
+async def drive(base_url: str, questions: list, total: int, concurrency: int, use_cache: bool) -> dict:
+    latencies, statuses = [], {}
+    counter = iter(range(total))
+
+    async def user(session):
+        for number in counter:
+            body = {'id': number, 'query': questions[number % len(questions)], 'use_cache': use_cache}
+            started = time.perf_counter()
+            try:
+                async with session.post(f'{base_url}/api/request', json=body) as response:
+                    await response.read()
+                    status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = type(e).__name__
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+
+    timeout = aiohttp.ClientTimeout(total=300)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(user(session) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {'latencies': latencies, 'statuses': statuses, 'elapsed': elapsed}
+
+
+def summarize(run: dict, total: int) -> dict:
+    latencies = run['latencies']
+    return {
+        'requests': total,
+        'ok': len(latencies),
+        'statuses': {str(key): value for key, value in sorted(run['statuses'].items(), key=str)},
+        'error_rate': round(1 - len(latencies) / total, 4) if total else 0.0,
+        'elapsed_s': round(run['elapsed'], 3),
+        'rps': round(len(latencies) / run['elapsed'], 3) if run['elapsed'] else 0.0,
+        'mean_s': round(statistics.mean(latencies), 3) if latencies else 0.0,
+        'p50_s': round(percentile(latencies, 50), 3),
+        'p95_s': round(percentile(latencies, 95), 3),
+        'p99_s': round(percentile(latencies, 99), 3),
+        'max_s': round(max(latencies), 3) if latencies else 0.0,
+    }
+
+
+def compare(result: dict, baseline: dict, max_regression: float) -> tuple:
+    """Изменения относительно базового прогона в процентах и список ухудшений сверх max_regression"""
+    changes, regressions = {}, []
+    for name, higher_is_better in COMPARED.items():
+        old, new = baseline['summary'].get(name), result['summary'].get(name)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else (0.0 if new == old else float('inf'))
+        changes[name] = {'baseline': old, 'current': new, 'change_percent': round(change, 1)}
+        worse = -change if higher_is_better else change
+        if worse > max_regression:
+            regressions.append(name)
+    return changes, regressions
+
+
+async def run(args, stub_argv: list) -> dict:
+    stub_port, app_port = free_port(), free_port()
+    workdir = tempfile.mkdtemp(prefix='ai_qa_bench_')
+    env = {
+        **os.environ,
+        'YANDEX_SEARCH_URL': f'http://127.0.0.1:{stub_port}/search/xml',
+        'YANDEX_SEARCH_ID': 'stub',
+        'YANDEX_SEARCH_SECRET': 'stub',
+        'OPENAI_BASE_URL': f'http://127.0.0.1:{stub_port}/v1',
+        'OPENAI_API_KEY': 'stub',
+        # Все страницы заглушки на одном хосте, поэтому ограничение на хост снимается
+        'HTTP_POOL_LIMIT_PER_HOST': os.getenv('HTTP_POOL_LIMIT', '100'),
+        'SEARCH_CACHE_PATH': os.path.join(workdir, 'search.sqlite'),
+        'LLM_CACHE_PATH': os.path.join(workdir, 'llm.sqlite'),
+        'ANSWER_CACHE_PATH': os.path.join(workdir, 'answers.sqlite'),
+        'PAGE_CACHE_PATH': '',
+        'LOCAL_INDEX_PATH': os.path.join(workdir, 'pages_index.sqlite'),
+        'PROMETHEUS_MULTIPROC_DIR': os.path.join(workdir, 'prometheus'),
+        'LOG_BODY_SAMPLE_RATE': '0',
+    }
+    for item in args.env:
+        key, _, value = item.partition('=')
+        env[key] = value
+    os.makedirs(env['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+    stub = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.stub_servers', '--port', str(stub_port), *stub_argv],
+        env=env,
+    )
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'main:app', '-c', 'gunicorn.conf.py', '--workers', str(args.workers),
+         '--worker-class', 'uvicorn.workers.UvicornWorker', '--bind', f'127.0.0.1:{app_port}',
+         '--log-level', 'warning'],
+        env=env, stdout=subprocess.DEVNULL if args.quiet else None, stderr=subprocess.DEVNULL if args.quiet else None,
+    )
+    base_url = f'http://127.0.0.1:{app_port}'
+    try:
+        await wait_until_up(f'http://127.0.0.1:{stub_port}/stub/stats', stub)
+        await wait_until_up(f'{base_url}/api/stats', server)
+        if args.warmup:
+            await drive(base_url, args.questions, args.warmup, min(args.concurrency, args.warmup), args.use_cache)
+
+        sampler = ResourceSampler(server.pid)
+        sampler.sample()
+        sampling = asyncio.create_task(sampler.run())
+        try:
+            result = await drive(base_url, args.questions, args.requests, args.concurrency, args.use_cache)
+        finally:
+            sampling.cancel()
+        sampler.sample()
+
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f'http://127.0.0.1:{stub_port}/stub/stats') as response:
+                upstream = await response.json()
+    finally:
+        for process in (server, stub):
+            process.terminate()
+        for process in (server, stub):
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'config': {
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'requests': args.requests,
+            'use_cache': args.use_cache,
+            'env': args.env,
+            'stubs': stub_argv,
+        },
+        'summary': summarize(result, args.requests),
+        'workers': sampler.report(result['elapsed']),
+        'upstream_calls': upstream,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--concurrency', type=int, default=8, help='simultaneous clients')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=0, help='requests sent before measuring')
+    parser.add_argument('--questions', help='file with one JSON-encoded question per line')
+    parser.add_argument('--use-cache', action='store_true', help='let repeated questions hit the caches')
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra environment for the service, e.g. PIPELINE_MODE=staged')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--max-regression', type=float, default=10.0,
+                        help='exit with code 1 if a compared metric is worse than the baseline by more percent')
+    parser.add_argument('--quiet', action='store_true', help='hide service logs')
+    stub_options = add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.questions:
+        with open(args.questions, encoding='utf-8') as f:
+            args.questions = [json.loads(line) for line in f if line.strip()]
+    else:
+        args.questions = QUESTIONS
+
+    stub_argv = []
+    for option in stub_options:
+        value = getattr(args, option.lstrip('-').replace('-', '_'))
+        if value is not None and value != parser.get_default(option.lstrip('-').replace('-', '_')):
+            stub_argv += [option, str(value)]
+
+    result = asyncio.run(run(args, stub_argv))
+
+    regressions = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        result['baseline_config'] = baseline['config']
+        result['comparison'], regressions = compare(result, baseline, args.max_regression)
+        result['regressions'] = regressions
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2, ensure_ascii=False)
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
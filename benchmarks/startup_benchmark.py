@@ -0,0 +1,138 @@
+"""Время старта сервиса: импорт main в чистом интерпретаторе и запуск gunicorn до готовности воркеров.
+
+Для каждого режима (обычный и --preload) печатает время импорта, время до первого ответа 200
+на /ready и до готовности всех воркеров, длительность прогрева в воркерах и память процессов
+(RSS и PSS, учитывающий общие после fork страницы):
+
+    python -m benchmarks.startup_benchmark --workers 4 --runs 3
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+from benchmarks.load_test import free_port, worker_pids
+
+IMPORT_SNIPPET = 'import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)'
+
+
+def service_env(workdir: str) -> dict:
+    env = {
+        **os.environ,
+        'OPENAI_API_KEY': os.getenv('OPENAI_API_KEY', 'stub'),
+        'SEARCH_CACHE_PATH': os.path.join(workdir, 'search.sqlite'),
+        'LLM_CACHE_PATH': os.path.join(workdir, 'llm.sqlite'),
+        'ANSWER_CACHE_PATH': os.path.join(workdir, 'answers.sqlite'),
+        'LOCAL_INDEX_PATH': os.path.join(workdir, 'pages_index.sqlite'),
+        'PROMETHEUS_MULTIPROC_DIR': os.path.join(workdir, 'prometheus'),
+    }
+    os.makedirs(env['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+    return env
+
+
+def memory_mb(pid: int) -> dict:
+    """RSS и PSS процесса в МБ по /proc (Linux)"""
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key, _, rest = line.partition(':')
+            if key in ('Rss', 'Pss'):
+                values[key.lower() + '_mb'] = int(rest.split()[0]) / 1024
+    return values
+
+
+def import_seconds(env: dict) -> float:
+    output = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+async def wait_ready(url: str, process: subprocess.Popen, workers: int, started: float, timeout: float) -> dict:
+    """Опрашивает /ready новыми соединениями, пока не ответят все воркеры"""
+    first, ready = None, {}
+    deadline = started + timeout
+    while time.perf_counter() < deadline and len(ready) < workers:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with code {process.returncode}")
+        try:
+            # Без keep-alive каждое соединение заново попадает к одному из воркеров
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(force_close=True)) as session:
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=2)) as response:
+                    body = await response.json()
+            if response.status == 200:
+                first = first or time.perf_counter() - started
+                ready.setdefault(body['pid'], body)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            pass
+        await asyncio.sleep(0.05)
+    if len(ready) < workers:
+        raise RuntimeError(f"only {len(ready)} of {workers} workers became ready in {timeout}s")
+    return {'first_ready_s': first, 'all_ready_s': time.perf_counter() - started, 'workers': list(ready.values())}
+
+
+async def start_once(env: dict, workers: int, preload: bool, timeout: float) -> dict:
+    port = free_port()
+    command = [sys.executable, '-m', 'gunicorn', 'main:app', '-c', 'gunicorn.conf.py', '--workers', str(workers),
+               '--worker-class', 'uvicorn.workers.UvicornWorker', '--bind', f'127.0.0.1:{port}',
+               '--log-level', 'warning']
+    if preload:
+        command.append('--preload')
+    started = time.perf_counter()
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        result = await wait_ready(f'http://127.0.0.1:{port}/ready', server, workers, started, timeout)
+        memory = [memory_mb(pid) for pid in [server.pid, *worker_pids(server.pid)]]
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return {
+        'first_ready_s': result['first_ready_s'],
+        'all_ready_s': result['all_ready_s'],
+        'max_warmup_s': max(worker['warmup_seconds'] or 0.0 for worker in result['workers']),
+        'rss_mb': sum(item.get('rss_mb', 0.0) for item in memory),
+        'pss_mb': sum(item.get('pss_mb', 0.0) for item in memory),
+    }
+
+
+def median_of(runs: list) -> dict:
+    return {key: round(statistics.median(run[key] for run in runs), 3) for key in runs[0]}
+
+
+async def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix='ai_qa_startup_')
+    try:
+        env = service_env(workdir)
+        result = {
+            'config': {'workers': args.workers, 'runs': args.runs},
+            'import_main_s': round(statistics.median(import_seconds(env) for _ in range(args.runs)), 3),
+        }
+        for mode, preload in (('default', False), ('preload', True)):
+            runs = [await start_once(env, args.workers, preload, args.timeout) for _ in range(args.runs)]
+            result[mode] = median_of(runs)
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--runs', type=int, default=3, help='starts per mode, the median is reported')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds to wait for all workers')
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args)), indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+"""Локальные заглушки внешних сервисов для нагрузочного тестирования без сети и квот.
+
+На одном порту поднимаются:
+  /search/xml            совместимый с Yandex XML поиск, 10 результатов на запрос
+  /pages/{n}             HTML-страницы из каталога записанных страниц (--corpus) или сгенерированные,
+                         с логнормальным распределением задержки и размера
+  /v1/chat/completions   OpenAI-совместимый чат, возвращающий заготовленный structured output по схеме запроса;
+                         повторно встреченный префикс из схемы и системных сообщений от --llm-cache-min-tokens
+                         (по умолчанию 1024) токенов считается кэшированным
+
+    python -m benchmarks.stub_servers --port 8090 --page-latency-ms 150 --llm-latency-ms 600
+
+Приложение направляется на заглушки переменными окружения
+YANDEX_SEARCH_URL=http://127.0.0.1:8090/search/xml и OPENAI_BASE_URL=http://127.0.0.1:8090/v1.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from xml.sax.saxutils import escape
+
+from aiohttp import web
+
+WORDS = (
+    'университет кампус город история факультет студенты программа исследование здание основан году '
+    'центр развитие научный институт обучение направление проект международный рейтинг лаборатория '
+    'санкт-петербург москва россия образование технологии информация данные площадь улица район'
+).split()
+
+URL_PATTERN = re.compile(r'https?://[^\s"\'<>\]]+')
+
+
+class StubConfig:
+    def __init__(self, args):
+        self.args = args
+        self.corpus = []
+        if args.corpus:
+            for name in sorted(os.listdir(args.corpus)):
+                if name.endswith(('.html', '.htm')):
+                    with open(os.path.join(args.corpus, name), encoding='utf-8', errors='replace') as f:
+                        self.corpus.append(f.read())
+        self.stats = {'search': 0, 'pages': 0, 'page_errors': 0, 'llm': 0, 'llm_429': 0, 'llm_cached_tokens': 0}
+        self.prefixes = set()
+
+    def rng(self, *parts) -> random.Random:
+        # Одинаковый URL всегда даёт одинаковые размер и задержку, прогоны сравнимы между собой
+        seed = hashlib.sha256(json.dumps([self.args.seed, *parts]).encode()).digest()
+        return random.Random(int.from_bytes(seed[:8], 'big'))
+
+
+def lognormal_ms(rng: random.Random, median_ms: float, sigma: float) -> float:
+    return median_ms * rng.lognormvariate(0, sigma) / 1000 if median_ms > 0 else 0.0
+
+
+def page_url(request: web.Request, number: int) -> str:
+    return f"http://{request.host}/pages/{number}"
+
+
+async def search_handler(request: web.Request) -> web.Response:
+    config: StubConfig = request.app['config']
+    query = request.query.get('query', '')
+    rng = config.rng('search', query)
+    config.stats['search'] += 1
+    await asyncio.sleep(lognormal_ms(rng, config.args.search_latency_ms, 0.3))
+
+    # Соседние запросы частично делят страницы, как реальная выдача по одной теме
+    first = rng.randrange(config.args.page_pool)
+    groups = []
+    for position in range(10):
+        number = (first + position * rng.randint(1, 7)) % config.args.page_pool
+        title = ' '.join(rng.choice(WORDS) for _ in range(6))
+        passage = ' '.join(rng.choice(WORDS) for _ in range(25))
+        groups.append(
+            f"<group><doc><url>{escape(page_url(request, number))}</url><title>{escape(title)}</title>"
+            f"<passages><passage>{escape(passage)}</passage></passages></doc></group>"
+        )
+    body = (
+        '<?xml version="1.0" encoding="utf-8"?><yandexsearch version="1.0">'
+        f"<request><query>{escape(query)}</query></request><response><results><grouping>"
+        + ''.join(groups) +
+        '</grouping></results></response></yandexsearch>'
+    )
+    return web.Response(text=body, content_type='text/xml')
+
+
+def synthetic_page(rng: random.Random, size: int) -> str:
+    paragraphs, length = [], 0
+    while length < size:
+        paragraph = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(30, 90))).capitalize() + '.'
+        paragraphs.append(f"<p>{paragraph}</p>")
+        length += len(paragraph) * 2  # кириллица в UTF-8
+    return (
+        '<!DOCTYPE html><html><head><meta charset="utf-8"><title>Страница</title>'
+        '<script>var analytics = {};</script><style>body {margin: 0}</style></head><body>'
+        '<nav><a href="/">Главная</a></nav><article>' + ''.join(paragraphs) + '</article>'
+        '<footer>Контакты</footer></body></html>'
+    )
+
+
+async def page_handler(request: web.Request) -> web.Response:
+    config: StubConfig = request.app['config']
+    args = config.args
+    number = int(request.match_info['number'])
+    rng = config.rng('page', number)
+    config.stats['pages'] += 1
+    await asyncio.sleep(lognormal_ms(rng, args.page_latency_ms, args.page_latency_sigma))
+    if rng.random() < args.page_error_rate:
+        config.stats['page_errors'] += 1
+        return web.Response(status=503, text='unavailable')
+
+    if config.corpus:
+        html = config.corpus[number % len(config.corpus)]
+    else:
+        html = synthetic_page(rng, int(args.page_kb * 1024 * rng.lognormvariate(0, args.page_size_sigma)))
+    etag = '"' + hashlib.md5(html.encode()).hexdigest() + '"'
+    if request.headers.get('If-None-Match') == etag:
+        return web.Response(status=304, headers={'ETag': etag})
+    return web.Response(text=html, content_type='text/html', charset='utf-8', headers={'ETag': etag})
+
+
+def resolve(schema: dict, root: dict) -> dict:
+    while '$ref' in schema:
+        schema = root['$defs'][schema['$ref'].split('/')[-1]]
+    return schema
+
+
+def fake_value(schema: dict, root: dict, name: str, context: dict):
+    """Значение, удовлетворяющее JSON-схеме поля; ответ и источники подбираются правдоподобно"""
+    schema = resolve(schema, root)
+    if 'anyOf' in schema:
+        options = [option for option in schema['anyOf'] if option.get('type') != 'null'] or schema['anyOf']
+        return fake_value(options[0], root, name, context)
+    kind = schema.get('type')
+    if kind == 'object':
+        return {
+            key: fake_value(value, root, key, context)
+            for key, value in schema.get('properties', {}).items()
+        }
+    if kind == 'array':
+        count = context['array_size'] if name in ('summaries', 'search_queries') else 2
+        items = [fake_value(schema.get('items', {}), root, name, context) for _ in range(count)]
+        if name == 'sources':
+            return context['urls'][:3]
+        return items
+    if kind == 'integer':
+        return context['answer'] if name == 'answer' else 1
+    if kind == 'number':
+        return 1.0
+    if kind == 'boolean':
+        return context['clear'] if name == 'is_answer_clear' else True
+    if name in ('source', 'url'):
+        return context['urls'][0] if context['urls'] else 'https://example.com/'
+    if name.startswith('search_quer'):
+        return ' '.join(context['rng'].choice(WORDS) for _ in range(4))
+    return ' '.join(context['rng'].choice(WORDS) for _ in range(context['words']))
+
+
+async def chat_handler(request: web.Request) -> web.Response:
+    config: StubConfig = request.app['config']
+    args = config.args
+    payload = await request.json()
+    prompt = '\n'.join(str(message.get('content', '')) for message in payload.get('messages', []))
+    rng = random.Random(f"{args.seed}:{time.perf_counter_ns()}")
+    config.stats['llm'] += 1
+
+    if rng.random() < args.llm_429_rate:
+        config.stats['llm_429'] += 1
+        return web.json_response(
+            {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit_exceeded'}},
+            status=429, headers={'Retry-After': '1'},
+        )
+
+    tools = payload.get('tools') or []
+    response_format = payload.get('response_format') or {}
+    if tools:
+        schema = tools[0]['function']['parameters']
+    elif response_format.get('type') == 'json_schema':
+        schema = response_format['json_schema']['schema']
+    else:
+        schema = {'type': 'object', 'properties': {}}
+
+    urls = list(dict.fromkeys(URL_PATTERN.findall(prompt)))
+    context = {
+        'rng': rng,
+        'urls': urls,
+        'answer': rng.randint(1, 4),
+        'clear': rng.random() < args.llm_clear_rate,
+        'words': args.llm_output_words,
+        'array_size': max(1, len(urls)),
+    }
+    arguments = json.dumps(fake_value(schema, schema, '', context), ensure_ascii=False)
+    # Префиксный кэш как у OpenAI: схема и системные сообщения, от --llm-cache-min-tokens токенов, блоками по 128
+    prefix = json.dumps(tools or response_format, sort_keys=True) + ''.join(
+        str(message.get('content', '')) for message in payload.get('messages', []) if message.get('role') == 'system')
+    prefix_tokens = len(prefix) // 3
+    # Схема, как и у OpenAI, входит в токены промпта
+    prompt_tokens = len(prompt) // 3 + len(json.dumps(tools or response_format, sort_keys=True)) // 3
+    cached_tokens = 0
+    if prefix_tokens >= args.llm_cache_min_tokens:
+        if prefix in config.prefixes:
+            cached_tokens = prefix_tokens // 128 * 128
+        config.prefixes.add(prefix)
+    config.stats['llm_cached_tokens'] += cached_tokens
+    completion_tokens = len(arguments) // 3
+    await asyncio.sleep(lognormal_ms(rng, args.llm_latency_ms, 0.4) + completion_tokens * args.llm_ms_per_token / 1000)
+
+    message = {'role': 'assistant', 'content': None if tools else arguments, 'refusal': None}
+    if tools:
+        message['tool_calls'] = [{
+            'id': f"call_{rng.getrandbits(32):x}", 'type': 'function',
+            'function': {'name': tools[0]['function']['name'], 'arguments': arguments},
+        }]
+    return web.json_response({
+        'id': f"chatcmpl-{rng.getrandbits(48):x}",
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': payload.get('model', 'stub'),
+        'choices': [{'index': 0, 'message': message, 'logprobs': None,
+                     'finish_reason': 'tool_calls' if tools else 'stop'}],
+        'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                  'total_tokens': prompt_tokens + completion_tokens,
+                  'prompt_tokens_details': {'cached_tokens': cached_tokens}},
+    })
+
+
+async def stats_handler(request: web.Request) -> web.Response:
+    return web.json_response(request.app['config'].stats)
+
+
+def build_app(args) -> web.Application:
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app['config'] = StubConfig(args)
+    app.router.add_get('/search/xml', search_handler)
+    app.router.add_get('/pages/{number:\\d+}', page_handler)
+    app.router.add_post('/v1/chat/completions', chat_handler)
+    app.router.add_get('/stub/stats', stats_handler)
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> list:
+    """Add stub options to parser, returns the option names (to forward them to a stub subprocess)"""
+    group = parser.add_argument_group('stub servers')
+    group.add_argument('--seed', type=int, default=0)
+    group.add_argument('--corpus', help='directory with recorded *.html pages (synthetic pages if omitted)')
+    group.add_argument('--page-pool', type=int, default=500, help='number of distinct page URLs')
+    group.add_argument('--page-latency-ms', type=float, default=150, help='median page latency')
+    group.add_argument('--page-latency-sigma', type=float, default=0.8, help='lognormal sigma of page latency')
+    group.add_argument('--page-kb', type=float, default=60, help='median synthetic page size')
+    group.add_argument('--page-size-sigma', type=float, default=0.7, help='lognormal sigma of page size')
+    group.add_argument('--page-error-rate', type=float, default=0.05)
+    group.add_argument('--search-latency-ms', type=float, default=300)
+    group.add_argument('--llm-latency-ms', type=float, default=500, help='median time to first token')
+    group.add_argument('--llm-ms-per-token', type=float, default=10)
+    group.add_argument('--llm-output-words', type=int, default=40)
+    group.add_argument('--llm-clear-rate', type=float, default=0.8, help='share of answers marked is_answer_clear')
+    group.add_argument('--llm-429-rate', type=float, default=0.0)
+    group.add_argument('--llm-cache-min-tokens', type=int, default=1024,
+                       help='shortest cacheable prompt prefix; lower it to see cached_tokens with short prompts')
+    return [action.option_strings[0] for action in group._group_actions]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    add_arguments(parser)
+    args = parser.parse_args()
+    web.run_app(build_app(args), host=args.host, port=args.port, access_log=None, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Сравнение суммаризации по одной странице и пакетами: задержка и расход токенов.
+
+Страницы берутся из JSON-файла со списком пар [url, text] или из живого поиска по запросу:
+
+    python -m benchmarks.summarization_benchmark --question "..." --pages pages.json --batch-size 5
+    python -m benchmarks.summarization_benchmark --question "..." --search-query "..." --repeat 3
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import agent_entrypoint
+from agent_entrypoint import summarize_content
+from async_search import get_clean_pages_texts
+from utils.http_client import close_http_client
+
+
+async def run_mode(question, pages, batch_size, repeat):
+    agent_entrypoint.SUMMARY_BATCH_SIZE = batch_size
+    stats = agent_entrypoint.llm_cache.stats
+    latencies = []
+    prompt_tokens = stats['prompt_tokens']
+    completion_tokens = stats['completion_tokens']
+    calls = stats['calls']
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await summarize_content(question, pages)
+        latencies.append(time.perf_counter() - started)
+    return {
+        'batch_size': batch_size,
+        'latency_mean_s': round(statistics.mean(latencies), 3),
+        'latency_max_s': round(max(latencies), 3),
+        'llm_calls_per_run': (stats['calls'] - calls) / repeat,
+        'prompt_tokens_per_run': (stats['prompt_tokens'] - prompt_tokens) / repeat,
+        'completion_tokens_per_run': (stats['completion_tokens'] - completion_tokens) / repeat,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--question', required=True)
+    parser.add_argument('--pages', help='JSON file with [[url, text], ...]')
+    parser.add_argument('--search-query', help='fetch pages with a live search instead of --pages')
+    parser.add_argument('--batch-size', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.pages:
+        with open(args.pages, encoding='utf-8') as f:
+            pages = [tuple(page) for page in json.load(f)]
+    elif args.search_query:
+        pages = list(await get_clean_pages_texts(args.search_query, max_length=agent_entrypoint.PAGE_TEXT_LENGTH))
+    else:
+        parser.error('either --pages or --search-query is required')
+
+    # Каждый прогон должен идти в модель, а не в кэш
+    agent_entrypoint.llm_cache.enabled = False
+    try:
+        results = [
+            await run_mode(args.question, pages, 0, args.repeat),
+            await run_mode(args.question, pages, args.batch_size, args.repeat),
+        ]
+    finally:
+        await close_http_client()
+
+    print(json.dumps({'pages': len(pages), 'results': results,
+                      'batching': agent_entrypoint.summary_batch_stats}, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
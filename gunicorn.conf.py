@@ -0,0 +1,13 @@
+from prometheus_client import multiprocess
+
+
+def when_ready(server):
+    # With --preload the app is already imported here: warm what is fork-safe once, workers share it
+    if server.cfg.preload_app:
+        from agent_entrypoint import preload_shared
+        preload_shared()
+
+
+def child_exit(server, worker):
+    # Drop live-only samples of the exited worker from the aggregated /metrics
+    multiprocess.mark_process_dead(worker.pid)
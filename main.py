@@ -1,90 +1,322 @@
+import asyncio
+import math
+import os
 import time
-from typing import List
-from agent_entrypoint import answer_mcq
+from typing import Awaitable, Optional
+from agent_entrypoint import (answer_mcq, deadline_stats, evidence_stats, llm_cache, llm_scheduler, pipeline_stats,
+                              snippet_stats, speculative_stats, summary_batch_stats, warmup)
+from async_search import search_cache, page_cache, parse_executor, fetch_stats, local_index, search_scheduler, shared_work
+from utils.cache import TieredCache
+from utils.http_client import start_http_client, close_http_client, http_pool_stats
+from utils.loop_monitor import LoopLagMonitor
+from utils.ranker import ranking_stats
+from utils.logger import setup_logger, start_logger, stop_logger
+from utils.middleware import RequestLoggingMiddleware, get_middleware_stats
+from utils.near_duplicates import dedup_stats
+from utils.option_matcher import matcher_stats
+from utils.scheduler import AdmissionGate, Overloaded
+from utils.singleflight import SingleFlight
+from utils.metrics import render_metrics, span
 from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import HttpUrl
-from schemas.request import PredictionRequest, PredictionResponse
-# from utils.logger import setup_logger
-from logging import Logger
+from schemas.request import BatchPredictionRequest, PredictionRequest, PredictionResponse
 # Initialize
 app = FastAPI()
-logger = Logger('main')
+logger = setup_logger()
+loop_monitor = LoopLagMonitor()
 
-# @app.on_event("startup")
-# async def startup_event():
-#     global logger
-#     logger = await setup_logger()
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 4))
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', 16))
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', 1000))
+# Сколько секунд вопрос пакета может ждать допуска при перегрузке, прежде чем вернуться с отказом
+BATCH_ADMISSION_WAIT = float(os.getenv('BATCH_ADMISSION_WAIT', 600))
+# Запросы сверх MAX_INFLIGHT_REQUESTS на воркер, а также при переполненной очереди или паузе после 429
+# у LLM/поиска, сразу получают 503/429 с Retry-After вместо ожидания в очереди
+admission = AdmissionGate(int(os.getenv('MAX_INFLIGHT_REQUESTS', 32)), llm_scheduler, search_scheduler)
 
+batch_stats = {'batches': 0, 'requests': 0, 'failed': 0, 'retried': 0, 'shared_fetches': 0}
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    start_time = time.time()
+# Как часто проверять, не закрыл ли клиент соединение: тогда вся работа по запросу отменяется
+DISCONNECT_POLL_INTERVAL = float(os.getenv('DISCONNECT_POLL_INTERVAL', 1.0))
+disconnect_stats = {'client_disconnects': 0}
 
-    body = await request.body()
-    logger.info(
-        f"Incoming request: {request.method} {request.url}\n"
-        f"Request body: {body.decode()}"
-    )
+# Кэш готовых ответов по нормализованному тексту вопроса, SQLite-уровень общий для всех воркеров.
+# Одинаковые одновременные вопросы в воркере считаются один раз, id подставляется для каждого клиента
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', '1') == '1'
+answer_cache = TieredCache(
+    'answers',
+    maxsize=int(os.getenv('ANSWER_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('ANSWER_CACHE_TTL', 3600)),
+    path=os.getenv('ANSWER_CACHE_PATH', 'cache/answers.sqlite') or None,
+    disk_maxsize=int(os.getenv('ANSWER_CACHE_DISK_SIZE', 20000)),
+)
+answer_flights = SingleFlight()
+answer_stats = {'computed': 0, 'coalesced': 0, 'cache_hits': 0, 'cached': 0}
 
-    response = await call_next(request)
-    process_time = time.time() - start_time
+# Прогрев воркера (клиент OpenAI, structured-output цепочки, HTTP-пул) идёт в фоне после старта,
+# /ready отвечает 503, пока он не закончится
+WARMUP = os.getenv('WARMUP', '1') == '1'
+readiness = {'ready': False, 'started_at': None, 'warmup_seconds': None, 'warmup_error': None}
 
-    response_body = b""
-    async for chunk in response.body_iterator:
-        response_body += chunk
+app.add_middleware(
+    RequestLoggingMiddleware,
+    logger=logger,
+    body_sample_rate=float(os.getenv('LOG_BODY_SAMPLE_RATE', 1.0)),
+    body_max_bytes=int(os.getenv('LOG_BODY_MAX_BYTES', 2048)),
+)
 
-    logger.info(
-        f"Request completed: {request.method} {request.url}\n"
-        f"Status: {response.status_code}\n"
-        f"Response body: {response_body.decode()}\n"
-        f"Duration: {process_time:.3f}s"
-    )
 
-    return Response(
-        content=response_body,
-        status_code=response.status_code,
-        headers=dict(response.headers),
-        media_type=response.media_type,
-    )
+@app.on_event("startup")
+async def startup_event():
+    start_logger()
+    await start_http_client()
+    parse_executor.start()
+    loop_monitor.start()
+    readiness['started_at'] = time.time()
+    if WARMUP:
+        app.state.warmup_task = asyncio.ensure_future(run_warmup())
+    else:
+        readiness['ready'] = True
+
+
+async def run_warmup():
+    started = time.perf_counter()
+    try:
+        await warmup()
+    except Exception as e:
+        # Без прогрева всё создаётся при первом запросе, воркер остаётся рабочим
+        readiness['warmup_error'] = str(e)
+        logger.warning(f"Warmup failed: {e}")
+    readiness['warmup_seconds'] = round(time.perf_counter() - started, 3)
+    readiness['ready'] = True
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    readiness['ready'] = False
+    warmup_task = getattr(app.state, 'warmup_task', None)
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await loop_monitor.stop()
+    parse_executor.shutdown()
+    await close_http_client()
+    stop_logger()
+
+
+@app.get("/api/stats")
+async def stats():
+    return {
+        'search_cache': search_cache.get_stats(),
+        'http_pool': http_pool_stats(),
+        'page_cache': page_cache.get_stats(),
+        'page_fetch': fetch_stats,
+        'local_index': local_index.get_stats() if local_index is not None else None,
+        'llm_cache': llm_cache.get_stats(),
+        'passage_ranking': ranking_stats,
+        'summary_batching': summary_batch_stats,
+        'pipeline': pipeline_stats,
+        'snippets': snippet_stats,
+        'evidence': evidence_stats,
+        'near_duplicates': dedup_stats,
+        'request_logging': get_middleware_stats(),
+        'speculative': speculative_stats,
+        'parsing': parse_executor.get_stats(),
+        'event_loop': loop_monitor.get_stats(),
+        'batch': batch_stats,
+        'option_matching': matcher_stats,
+        'upstreams': {'llm': llm_scheduler.get_stats(), 'search': search_scheduler.get_stats()},
+        'admission': admission.get_stats(),
+        'deadlines': {**deadline_stats, **disconnect_stats},
+        'answers': {**answer_stats, 'in_flight': len(answer_flights), 'storage': answer_cache.get_stats()},
+    }
+
+
+@app.get("/ready")
+async def ready(response: Response):
+    if not readiness['ready']:
+        response.status_code = 503
+    return {**readiness, 'pid': os.getpid()}
+
+
+@app.get("/metrics")
+async def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
+def build_prediction_response(body: PredictionRequest, full_answer: dict) -> PredictionResponse:
+    try:
+        return PredictionResponse(
+            id=body.id,
+            answer=full_answer['answer'],
+            reasoning='Ответ сгенерирован при помощи gpt4o-mini; ' + full_answer['reasoning'],
+            sources=full_answer['sources'],
+        )
+    except:
+        return PredictionResponse(
+            id=body.id,
+            answer=full_answer['answer'],
+            reasoning='Ответ сгенерирован при помощи gpt4o-mini; ' + full_answer['reasoning'],
+            sources=[],
+        )
+
+
+def overloaded_error(e: Overloaded) -> HTTPException:
+    return HTTPException(status_code=e.status, detail=e.reason, headers={'Retry-After': str(math.ceil(e.retry_after))})
+
+
+def answer_key(query: str) -> str:
+    return ' '.join(query.lower().replace('ё', 'е').split())
+
+
+async def compute_response(key: str, body: PredictionRequest) -> dict:
+    answer_stats['computed'] += 1
+    with span('answer'):
+        full_answer = await answer_mcq({'id': body.id, 'query': body.query, 'use_cache': body.use_cache,
+                                        'timeout': body.timeout})
+    payload = build_prediction_response(body, full_answer).model_dump(mode='json')
+    # Неясные ответы, в том числе собранные по истечении срока, не кэшируются
+    if ANSWER_CACHE_ENABLED and full_answer['answer'] is not None and full_answer.get('is_answer_clear'):
+        await answer_cache.set(key, payload)
+        answer_stats['cached'] += 1
+    return payload
+
+
+async def shared_response(body: PredictionRequest) -> PredictionResponse:
+    """Ответ из кэша, из уже идущего вычисления того же вопроса или новый; id - всегда из запроса"""
+    if not (ANSWER_CACHE_ENABLED and body.use_cache):
+        payload = await compute_response(answer_key(body.query), body)
+        return PredictionResponse(**payload)
+    key = answer_key(body.query)
+    payload = await answer_cache.get(key)
+    if payload is not None:
+        answer_stats['cache_hits'] += 1
+    else:
+        # Общее вычисление идёт со сроком первого запроса, поэтому объединяются только запросы с одинаковым
+        # сроком: присоединившийся позже получит ответ не позже своего срока и не по более короткому
+        flight = (key, body.timeout)
+        if flight in answer_flights:
+            answer_stats['coalesced'] += 1
+        payload = await answer_flights.do(flight, lambda: compute_response(key, body))
+    return PredictionResponse(**{**payload, 'id': body.id})
+
+
+async def answer_until_disconnect(request: Request, answer: Awaitable[PredictionResponse]) -> Optional[PredictionResponse]:
+    """Ждёт ответа, пока клиент на связи; после отключения ожидание отменяется и возвращается None.
+
+    Общее с другими клиентами вычисление отменяется, только когда его больше никто не ждёт.
+    """
+    task = asyncio.ensure_future(answer)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                disconnect_stats['client_disconnects'] += 1
+                return None
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
 
 
 @app.post("/api/request", response_model=PredictionResponse)
-async def predict(body: PredictionRequest):
+async def predict(body: PredictionRequest, request: Request):
     try:
-        logger.info(f"Processing prediction request with id: {body.id}")
+        admission.enter()
+    except Overloaded as e:
+        logger.warning(f"Rejected request {body.id}: {e.reason}")
+        raise overloaded_error(e)
 
-        temp_dict_to_pass_into_model = {
-            'id': body.id,
-            'query': body.query
-        }
+    try:
+        logger.info(f"Processing prediction request with id: {body.id}")
 
-        full_answer = await answer_mcq(temp_dict_to_pass_into_model)  # Замените на реальный вызов модели
+        response = await answer_until_disconnect(request, shared_response(body))
+        if response is None:
+            logger.warning(f"Client disconnected, request {body.id} cancelled")
+            # Ответ уже некому отдать; 499 - код nginx для закрытого клиентом запроса
+            raise HTTPException(status_code=499, detail="Client closed request")
 
-        try:
-            response = PredictionResponse(
-                id=body.id,
-                answer=full_answer['answer'],
-                reasoning='Ответ сгенерирован при помощи gpt4o-mini; ' + full_answer['reasoning'],
-                sources=full_answer['sources'],
-            )
-
-            logger.info(f"Successfully processed request {body.id}")
-            return response
-        except:
-            response = PredictionResponse(
-                id=body.id,
-                answer=full_answer['answer'],
-                reasoning='Ответ сгенерирован при помощи gpt4o-mini; ' + full_answer['reasoning'],
-                sources=[],
-            )
-
-            logger.info(f"Successfully processed request {body.id}")
-            return response
+        logger.info(f"Successfully processed request {body.id}")
+        return response
 
+    except HTTPException:
+        raise
+    except Overloaded as e:
+        logger.warning(f"Request {body.id} dropped: {e.reason}")
+        raise overloaded_error(e)
     except ValueError as e:
         error_msg = str(e)
         logger.error(f"Validation error for request {body.id}: {error_msg}")
         raise HTTPException(status_code=400, detail=error_msg)
     except Exception as e:
         logger.error(f"Internal error processing request {body.id}: {str(e)}")
-        raise HTTPException(status_code=500, detail="Internal server error")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal server error")
+    finally:
+        admission.leave()
+
+@app.post("/api/batch")
+async def predict_batch(body: BatchPredictionRequest):
+    """Answer many questions, streaming one PredictionResponse per line (NDJSON) as each completes.
+
+    Identical search queries and page fetches in flight at the same time are done once for the whole batch,
+    repeats later in the batch come from the search and page caches. Every question being answered takes
+    an admission slot like a single request; under overload it waits for one with backoff and is answered
+    with the rejection reason only after BATCH_ADMISSION_WAIT seconds.
+    """
+    if len(body.requests) > BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch is limited to {BATCH_MAX_SIZE} requests")
+    try:
+        admission.check()
+    except Overloaded as e:
+        logger.warning(f"Rejected batch of {len(body.requests)} requests: {e.reason}")
+        raise overloaded_error(e)
+    concurrency = max(1, min(body.concurrency or BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    logger.info(f"Processing batch of {len(body.requests)} requests with concurrency {concurrency}")
+
+    async def answer_one(item: PredictionRequest, semaphore: asyncio.Semaphore) -> PredictionResponse:
+        async with semaphore:
+            give_up_at = asyncio.get_running_loop().time() + BATCH_ADMISSION_WAIT
+            while True:
+                try:
+                    await admission.wait_enter(give_up_at)
+                    try:
+                        return await shared_response(item)
+                    finally:
+                        admission.leave()
+                except Overloaded as e:
+                    # Очередь к LLM/поиску переполнилась уже во время ответа: ждём и отвечаем заново
+                    if asyncio.get_running_loop().time() + e.retry_after < give_up_at:
+                        batch_stats['retried'] += 1
+                        await asyncio.sleep(e.retry_after)
+                        continue
+                    logger.warning(f"Batch request {item.id} dropped: {e.reason}")
+                    batch_stats['failed'] += 1
+                    return PredictionResponse(id=item.id, answer=None, reasoning=e.reason, sources=[])
+                except Exception as e:
+                    logger.error(f"Internal error processing batch request {item.id}: {str(e)}")
+                    batch_stats['failed'] += 1
+                    return PredictionResponse(id=item.id, answer=None, reasoning='Internal server error', sources=[])
+
+    async def stream():
+        scope = SingleFlight()
+        token = shared_work.set(scope)
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = [asyncio.create_task(answer_one(item, semaphore)) for item in body.requests]
+        shared_work.reset(token)
+        batch_stats['batches'] += 1
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                response = await next_done
+                batch_stats['requests'] += 1
+                yield response.model_dump_json() + '\n'
+        finally:
+            # Клиент мог отключиться посреди пакета
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            batch_stats['shared_fetches'] += scope.stats['shared']
+
+    return StreamingResponse(stream(), media_type='application/x-ndjson')
@@ -0,0 +1,134 @@
+"""Предварительный обход сайтов в локальный полнотекстовый индекс (LOCAL_INDEX_PATH).
+
+Обходит страницы в ширину внутри заданных доменов, начиная с их главных страниц (или с заданных URL), учитывает robots.txt
+и пропускает страницы, проиндексированные недавно, поэтому повторный запуск дообновляет индекс:
+
+    python precrawl.py itmo.ru abit.itmo.ru --max-pages 2000 --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import time
+import urllib.robotparser
+from urllib.parse import urldefrag, urljoin, urlparse
+
+import lxml.html
+
+from async_search import clean_page_text, fetch_page_html, local_index
+from utils.http_client import USER_AGENT, close_http_client, get_http_client
+
+SKIPPED_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.gif', '.svg', '.zip', '.rar', '.doc', '.docx',
+                      '.xls', '.xlsx', '.ppt', '.pptx', '.mp4', '.mp3', '.webp', '.ico', '.css', '.js')
+
+
+def in_domains(url: str, domains: list) -> bool:
+    host = urlparse(url).hostname or ''
+    return any(host == domain or host.endswith('.' + domain) for domain in domains)
+
+
+def extract_links(html: str, base_url: str) -> list:
+    try:
+        document = lxml.html.fromstring(html)
+    except Exception:
+        return []
+    links = []
+    for href in document.xpath('//a/@href'):
+        url, _ = urldefrag(urljoin(base_url, href.strip()))
+        if url.startswith(('http://', 'https://')) and not urlparse(url).path.lower().endswith(SKIPPED_EXTENSIONS):
+            links.append(url)
+    return links
+
+
+async def load_robots(session, seed: str) -> urllib.robotparser.RobotFileParser:
+    robots = urllib.robotparser.RobotFileParser()
+    try:
+        async with session.get(urljoin(seed, '/robots.txt')) as response:
+            robots.parse((await response.text()).splitlines() if response.status == 200 else [])
+    except Exception:
+        robots.parse([])
+    return robots
+
+
+async def crawl(sites: list, max_pages: int, concurrency: int, refresh_after: float, delay: float) -> dict:
+    # Сайт задаётся доменом (обход с https://домен/) или полным стартовым URL
+    seeds = [site if '://' in site else f'https://{site}/' for site in sites]
+    domains = [urlparse(seed).hostname for seed in seeds]
+    session = await get_http_client()
+    robots = {domain: await load_robots(session, seed) for domain, seed in zip(domains, seeds)}
+    queue = asyncio.Queue()
+    seen = set()
+    stats = {'fetched': 0, 'indexed': 0, 'skipped_fresh': 0, 'disallowed': 0, 'failed': 0}
+
+    def enqueue(url: str):
+        if url not in seen and len(seen) < max_pages and in_domains(url, domains):
+            seen.add(url)
+            queue.put_nowait(url)
+
+    for seed in seeds:
+        enqueue(seed)
+
+    async def worker():
+        while True:
+            url = await queue.get()
+            try:
+                domain = next(domain for domain in domains if in_domains(url, [domain]))
+                if not robots[domain].can_fetch(USER_AGENT, url):
+                    stats['disallowed'] += 1
+                    continue
+                fetched = await fetch_page_html(session, url)
+                stats['fetched'] += 1
+                if not fetched or not fetched[1]:
+                    stats['failed'] += 1
+                    continue
+                _, html, final_url, _, _ = fetched
+                for link in extract_links(html, final_url):
+                    enqueue(link)
+
+                indexed_at = await asyncio.to_thread(local_index.indexed_at, final_url)
+                if indexed_at is not None and time.time() - indexed_at < refresh_after:
+                    stats['skipped_fresh'] += 1
+                    continue
+                text = await asyncio.to_thread(clean_page_text, html)
+                if text:
+                    await asyncio.to_thread(local_index.add, final_url, text)
+                    stats['indexed'] += 1
+                if delay:
+                    await asyncio.sleep(delay)
+            except Exception:
+                stats['failed'] += 1
+            finally:
+                queue.task_done()
+
+    workers = [asyncio.create_task(worker()) for _ in range(concurrency)]
+    try:
+        await queue.join()
+    finally:
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+    return stats
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sites', nargs='+', help='domains (subdomains included) or start URLs to crawl')
+    parser.add_argument('--max-pages', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--refresh-after', type=float, default=24, help='hours before an indexed page is re-indexed')
+    parser.add_argument('--delay', type=float, default=0.0, help='pause per worker between pages, seconds')
+    args = parser.parse_args()
+    if local_index is None:
+        parser.error('LOCAL_INDEX_PATH is empty, the local index is disabled')
+
+    started = time.perf_counter()
+    try:
+        stats = await crawl(args.sites, args.max_pages, args.concurrency, args.refresh_after * 3600, args.delay)
+    finally:
+        await close_http_client()
+    stats['seconds'] = round(time.perf_counter() - started, 1)
+    stats['index'] = local_index.get_stats()
+    print(json.dumps(stats, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,11 +1,19 @@
 from typing import List
 
-from pydantic import BaseModel, HttpUrl
+from pydantic import BaseModel, Field, HttpUrl
 from typing import Optional
 
 class PredictionRequest(BaseModel):
     id: int
     query: str
+    use_cache: bool = True
+    # Срок ответа в секундах; по умолчанию REQUEST_TIMEOUT
+    timeout: Optional[float] = Field(default=None, gt=0)
+
+
+class BatchPredictionRequest(BaseModel):
+    requests: List[PredictionRequest]
+    concurrency: Optional[int] = None
 
 
 class PredictionResponse(BaseModel):
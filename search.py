@@ -56,7 +56,7 @@ def fetch_page_html(url):
 
 def get_search_results(query, folder_id, api_key):
     """Выполнение поискового запроса через Яндекс.XML"""
-    base_url = 'https://yandex.ru/search/xml'
+    base_url = os.getenv('YANDEX_SEARCH_URL', 'https://yandex.ru/search/xml')
     params = {
         'folderid': folder_id,
         'apikey': api_key,
@@ -114,8 +114,9 @@ def get_clean_pages_texts(query, max_results=10):
 
     return pages_info[:max_results]
 
-results = get_clean_pages_texts('Где находится университет ИТМО?')
+if __name__ == "__main__":
+    results = get_clean_pages_texts('Где находится университет ИТМО?')
 
-for idx, (url, text) in enumerate(results, 1):
-    print(f"\n{'='*80}\nРезультат {idx}:\nСсылка: {url}\nТекст:")
-    print(text[:1000] + '...' if len(text) > 1000 else text)
\ No newline at end of file
+    for idx, (url, text) in enumerate(results, 1):
+        print(f"\n{'='*80}\nРезультат {idx}:\nСсылка: {url}\nТекст:")
+        print(text[:1000] + '...' if len(text) > 1000 else text)
\ No newline at end of file
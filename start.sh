@@ -1,2 +1,13 @@
 #!/bin/bash
-gunicorn main:app --workers 4 --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:8080
\ No newline at end of file
+# Prometheus multiprocess mode: workers write metrics here and /metrics aggregates them
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# PRELOAD=1: приложение импортируется один раз в мастере (--preload), воркеры получают его через fork;
+# сетевые клиенты всё равно создаются в каждом воркере после fork
+PRELOAD_FLAG=""
+if [ "${PRELOAD:-0}" = "1" ]; then
+    PRELOAD_FLAG="--preload"
+fi
+
+gunicorn main:app -c gunicorn.conf.py $PRELOAD_FLAG --workers 4 --worker-class uvicorn.workers.UvicornWorker --bind 0.0.0.0:8080
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from utils import cache
+from utils.cache import TieredCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(cache.time, 'time', lambda: now[0])
+    return now
+
+
+def test_memory_entries_expire_after_ttl(clock):
+    async def main():
+        tiered = TieredCache('test', ttl=60)
+        await tiered.set('key', {'value': 1})
+        clock[0] += 59
+        assert await tiered.get('key') == {'value': 1}
+        clock[0] += 2
+        assert await tiered.get('key') is None
+        assert tiered.stats['memory_hits'] == 1 and tiered.stats['misses'] == 1
+
+    asyncio.run(main())
+
+
+def test_per_entry_ttl_overrides_default(clock):
+    async def main():
+        tiered = TieredCache('test', ttl=3600)
+        await tiered.set('key', 'value', ttl=10)
+        clock[0] += 11
+        assert await tiered.get('key') is None
+
+    asyncio.run(main())
+
+
+def test_disk_tier_serves_memory_misses_until_ttl(clock, tmp_path):
+    async def main():
+        path = str(tmp_path / 'cache.sqlite')
+        await TieredCache('test', ttl=60, path=path).set('key', [1, 2])
+        # A fresh memory tier, as in another worker process
+        other = TieredCache('test', ttl=60, path=path)
+        assert await other.get('key') == [1, 2]
+        assert other.stats['disk_hits'] == 1
+        clock[0] += 61
+        assert await TieredCache('test', ttl=60, path=path).get('key') is None
+
+    asyncio.run(main())
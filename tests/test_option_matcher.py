@@ -0,0 +1,49 @@
+from utils.option_matcher import OptionMatcher, option_variants
+
+QUESTION = 'В каком городе находится главный кампус университета ИТМО?\n1. Москва\n2. Санкт-Петербург'
+PAGE = 'Главный кампус университета ИТМО: город Санкт-Петербург, Кронверкский проспект.'
+
+
+def test_single_option_in_enough_sources_is_the_answer():
+    matcher = OptionMatcher(QUESTION, min_sources=2, min_context=2)
+    matcher.add_page('https://a.example', PAGE)
+    assert matcher.decide() is None
+    matcher.add_page('https://b.example', PAGE)
+    assert matcher.decide() == (2, ['https://a.example', 'https://b.example'])
+
+
+def test_several_options_found_is_ambiguous():
+    matcher = OptionMatcher(QUESTION, min_sources=1, min_context=2)
+    matcher.add_page('https://a.example', PAGE + ' Филиал университета ИТМО в городе Москва не открыт.')
+    assert matcher.decide() is None
+
+
+def test_option_without_question_context_is_ignored():
+    matcher = OptionMatcher(QUESTION, min_sources=1, min_context=2)
+    matcher.add_page('https://a.example', 'Погода в городе Москва на выходные.')
+    assert matcher.decide() is None
+
+
+def test_negated_question_is_left_to_llm():
+    for question in ('Какой из городов НЕ является местом расположения кампуса ИТМО?\n1. Москва\n2. Санкт-Петербург',
+                     'Все города, кроме одного, связаны с кампусами ИТМО:\n1. Москва\n2. Санкт-Петербург',
+                     'Какое утверждение неверно?\n1. Кампус в Москве\n2. Кампус в Санкт-Петербурге'):
+        matcher = OptionMatcher(question, min_sources=1, min_context=1)
+        assert matcher.negated and not matcher.usable
+        matcher.add_page('https://a.example', PAGE)
+        assert matcher.decide() is None
+
+
+def test_question_words_are_not_context():
+    matcher = OptionMatcher('Какой город является столицей?\n1. Москва\n2. Казань', min_context=1)
+    assert matcher.keywords == {'город', 'столиц'}
+
+
+def test_short_options_are_not_usable():
+    assert not OptionMatcher('Сколько корпусов?\n1. 3\n2. 5').usable
+
+
+def test_option_variants():
+    assert {'23-25', 'с 23 по 25', 'от 23 до 25'} <= set(option_variants('23–25'))
+    assert {'1 000 000', '1000000'} <= set(option_variants('1 000 000'))
+    assert '1 сентября 2023' in option_variants('01.09.2023')
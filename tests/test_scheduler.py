@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+import pytest
+
+from utils.deadline import deadline_after
+from utils.scheduler import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, UpstreamScheduler
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code: int, retry_after: float):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.headers = {'retry-after': str(retry_after)}
+
+
+def test_queued_calls_run_in_priority_order():
+    async def main():
+        scheduler = UpstreamScheduler('test', max_concurrency=1)
+        release, order = asyncio.Event(), []
+
+        async def blocker():
+            await release.wait()
+
+        async def call(name):
+            order.append(name)
+
+        running = asyncio.ensure_future(scheduler.submit(blocker))
+        await asyncio.sleep(0)
+        queued = [asyncio.ensure_future(scheduler.submit(lambda name=name: call(name), priority=priority))
+                  for name, priority in (('low', PRIORITY_LOW), ('normal', PRIORITY_NORMAL), ('high', PRIORITY_HIGH))]
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(running, *queued)
+        assert order == ['high', 'normal', 'low']
+
+    asyncio.run(main())
+
+
+def test_rate_limit_pauses_the_upstream():
+    async def main():
+        scheduler = UpstreamScheduler('test', backoff_base=0.001)
+        attempts = []
+
+        async def limited():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise UpstreamError(429, retry_after=0.2)
+            return 'ok'
+
+        async def other():
+            return time.monotonic()
+
+        first = asyncio.ensure_future(scheduler.submit(limited))
+        await asyncio.sleep(0.01)
+        assert scheduler.pause_remaining() > 0.1
+        paused_at = time.monotonic()
+        # Other calls to the paused upstream wait for the pause too
+        assert await scheduler.submit(other) - paused_at >= 0.15
+        assert await first == 'ok'
+        assert attempts[1] - attempts[0] >= 0.2
+        assert scheduler.stats['rate_limited'] == 1 and scheduler.stats['retries'] == 1
+
+    asyncio.run(main())
+
+
+def test_no_retry_past_the_request_deadline():
+    async def main():
+        scheduler = UpstreamScheduler('test')
+        attempts = []
+
+        async def failing():
+            attempts.append(1)
+            raise UpstreamError(503, retry_after=5)
+
+        with deadline_after(1):
+            with pytest.raises(UpstreamError):
+                await scheduler.submit(failing)
+        assert len(attempts) == 1
+        assert scheduler.stats['retries'] == 0 and scheduler.stats['failed'] == 1
+
+    asyncio.run(main())
+
+
+def test_retryable_failure_is_retried_without_deadline():
+    async def main():
+        scheduler = UpstreamScheduler('test', backoff_base=0.001)
+        attempts = []
+
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise ConnectionError('reset')
+            return 'ok'
+
+        assert await scheduler.submit(flaky) == 'ok'
+        assert scheduler.stats['retries'] == 2
+
+    asyncio.run(main())
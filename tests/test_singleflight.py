@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from utils.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_task():
+    async def main():
+        flights, calls = SingleFlight(), []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'result'
+
+        results = await asyncio.gather(*(flights.do('key', work) for _ in range(3)))
+        assert results == ['result'] * 3
+        assert len(calls) == 1 and flights.stats == {'calls': 1, 'shared': 2}
+        # Without keep_results a finished call is not remembered
+        assert 'key' not in flights
+        await flights.do('key', work)
+        assert len(calls) == 2
+
+    asyncio.run(main())
+
+
+def test_keep_results_reuses_successes_only():
+    async def main():
+        flights, calls = SingleFlight(keep_results=True), []
+
+        async def work():
+            calls.append(1)
+            return len(calls)
+
+        async def failing():
+            raise ValueError('boom')
+
+        assert await flights.do('key', work) == 1
+        assert await flights.do('key', work) == 1
+        with pytest.raises(ValueError):
+            await flights.do('bad', failing)
+        assert 'bad' not in flights
+
+    asyncio.run(main())
+
+
+def test_shared_task_survives_until_last_waiter_cancels():
+    async def main():
+        flights, started, cancelled = SingleFlight(), asyncio.Event(), asyncio.Event()
+
+        async def work():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        first = asyncio.ensure_future(flights.do('key', work))
+        second = asyncio.ensure_future(flights.do('key', work))
+        await started.wait()
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled.is_set()
+        second.cancel()
+        await asyncio.sleep(0.01)
+        assert cancelled.is_set() and 'key' not in flights
+
+    asyncio.run(main())
+
+
+def test_parent_shares_calls_across_scopes():
+    async def main():
+        parent, calls = SingleFlight(), []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return 'result'
+
+        first, second = SingleFlight(parent=parent), SingleFlight(parent=parent)
+        assert await asyncio.gather(first.do('key', work), second.do('key', work)) == ['result', 'result']
+        assert len(calls) == 1 and parent.stats['shared'] == 1
+
+    asyncio.run(main())
@@ -0,0 +1,149 @@
+import asyncio
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from utils.metrics import CACHE_LOOKUPS
+from utils.sqlite_db import SharedSQLite
+
+
+class MemoryTTLCache:
+    """In-process LRU cache with per-entry TTL"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.time():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.time() + (ttl or self.ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLiteTTLCache:
+    """On-disk cache shared between worker processes, values are stored as JSON"""
+
+    def __init__(self, path: str, table: str = 'cache', maxsize: int = 10000, ttl: float = 3600):
+        self.path = path
+        self.table = table
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.db = SharedSQLite(
+            path,
+            f'CREATE TABLE IF NOT EXISTS {table} '
+            '(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)',
+            f'CREATE INDEX IF NOT EXISTS {table}_accessed ON {table} (accessed_at)',
+        )
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self.db.lock:
+            conn = self.db.connection()
+            now = time.time()
+            row = conn.execute(f'SELECT value, expires_at FROM {self.table} WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                conn.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+                return None
+            conn.execute(f'UPDATE {self.table} SET accessed_at = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        data = json.dumps(value, ensure_ascii=False)
+        with self.db.lock:
+            conn = self.db.connection()
+            now = time.time()
+            conn.execute(
+                f'INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, data, now + (ttl or self.ttl), now)
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict()
+
+    def evict(self):
+        """Drop expired entries and trim the table down to maxsize by last access"""
+        with self.db.lock:
+            self._evict()
+
+    def _evict(self):
+        conn = self.db.connection()
+        conn.execute(f'DELETE FROM {self.table} WHERE expires_at < ?', (time.time(),))
+        conn.execute(
+            f'DELETE FROM {self.table} WHERE key IN ('
+            f'SELECT key FROM {self.table} ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)',
+            (self.maxsize,)
+        )
+
+    def __len__(self):
+        with self.db.lock:
+            return self.db.connection().execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+
+class TieredCache:
+    """Memory tier in front of an optional shared SQLite tier, with hit/miss counters"""
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 3600,
+                 path: Optional[str] = None, disk_maxsize: int = 10000):
+        self.name = name
+        self.ttl = ttl
+        self.memory = MemoryTTLCache(maxsize=maxsize, ttl=ttl)
+        self.disk = SQLiteTTLCache(path, table=name, maxsize=disk_maxsize, ttl=ttl) if path else None
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'errors': 0}
+
+    async def get(self, key: str) -> Optional[Any]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats['memory_hits'] += 1
+            CACHE_LOOKUPS.labels(self.name, 'memory_hit').inc()
+            return value
+        if self.disk is not None:
+            try:
+                value = await asyncio.to_thread(self.disk.get, key)
+            except sqlite3.Error:
+                self.stats['errors'] += 1
+                value = None
+            if value is not None:
+                self.stats['disk_hits'] += 1
+                CACHE_LOOKUPS.labels(self.name, 'disk_hit').inc()
+                self.memory.set(key, value)
+                return value
+        self.stats['misses'] += 1
+        CACHE_LOOKUPS.labels(self.name, 'miss').inc()
+        return None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            try:
+                await asyncio.to_thread(self.disk.set, key, value, ttl)
+            except sqlite3.Error:
+                self.stats['errors'] += 1
+
+    def get_stats(self) -> dict:
+        hits = self.stats['memory_hits'] + self.stats['disk_hits']
+        total = hits + self.stats['misses']
+        return {
+            **self.stats,
+            'hit_rate': round(hits / total, 4) if total else 0.0,
+            'memory_size': len(self.memory),
+        }
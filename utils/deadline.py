@@ -0,0 +1,48 @@
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+# Event loop time by which the current request must be answered, None when unbounded
+request_deadline: ContextVar[Optional[float]] = ContextVar('request_deadline', default=None)
+
+
+@contextmanager
+def deadline_after(seconds: Optional[float]):
+    """Bound the enclosed work to seconds from now; an outer, earlier deadline still wins"""
+    if not seconds or seconds <= 0:
+        yield request_deadline.get()
+        return
+    when = asyncio.get_running_loop().time() + seconds
+    outer = request_deadline.get()
+    token = request_deadline.set(when if outer is None else min(outer, when))
+    try:
+        yield request_deadline.get()
+    finally:
+        request_deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left until the request deadline (negative once it passed), None without one"""
+    when = request_deadline.get()
+    return None if when is None else when - asyncio.get_running_loop().time()
+
+
+def deadline_passed() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def budget(timeout: float) -> float:
+    """timeout shrunk to the time left; raises TimeoutError when nothing is left"""
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise asyncio.TimeoutError('request deadline exceeded')
+    return min(timeout, left)
+
+
+def timeout_scope():
+    """asyncio.timeout context that cancels the enclosed work at the request deadline"""
+    return asyncio.timeout_at(request_deadline.get())
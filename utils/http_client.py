@@ -0,0 +1,66 @@
+import os
+from typing import Optional
+
+import aiohttp
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+HTTP_POOL_LIMIT = int(os.getenv('HTTP_POOL_LIMIT', 100))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', 10))
+HTTP_DNS_CACHE_TTL = int(os.getenv('HTTP_DNS_CACHE_TTL', 300))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', 30))
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+async def start_http_client() -> aiohttp.ClientSession:
+    """Open the worker-wide pooled session (called from the app startup hook)"""
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=HTTP_POOL_LIMIT,
+            limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+            use_dns_cache=True,
+            keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+        )
+        _session = aiohttp.ClientSession(connector=connector, headers={"User-Agent": USER_AGENT})
+    return _session
+
+
+async def close_http_client():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+async def get_http_client() -> aiohttp.ClientSession:
+    """Shared session; opened lazily when the module is used outside of the FastAPI app"""
+    if _session is None or _session.closed:
+        return await start_http_client()
+    return _session
+
+
+def http_pool_stats() -> dict:
+    """Open/idle/acquired connection counts of the shared connector"""
+    if _session is None or _session.closed:
+        return {'open': 0, 'idle': 0, 'acquired': 0, 'limit': HTTP_POOL_LIMIT,
+                'limit_per_host': HTTP_POOL_LIMIT_PER_HOST, 'acquired_per_host': {}}
+
+    connector = _session.connector
+    # aiohttp doesn't expose pool counters publicly, read them from the connector state
+    idle = sum(len(conns) for conns in getattr(connector, '_conns', {}).values())
+    acquired = len(getattr(connector, '_acquired', ()))
+    acquired_per_host = {
+        f'{key.host}:{key.port}': len(conns)
+        for key, conns in getattr(connector, '_acquired_per_host', {}).items() if conns
+    }
+    return {
+        'open': idle + acquired,
+        'idle': idle,
+        'acquired': acquired,
+        'limit': connector.limit,
+        'limit_per_host': connector.limit_per_host,
+        'acquired_per_host': acquired_per_host,
+    }
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import time
+from functools import lru_cache
+from typing import List, Optional, Type
+
+from pydantic import BaseModel
+
+from utils.cache import TieredCache
+from utils.deadline import request_deadline, timeout_scope
+from utils.metrics import CACHE_LOOKUPS, LLM_TOKENS
+from utils.ranker import count_static_tokens, count_tokens
+from utils.scheduler import UpstreamScheduler
+from utils.singleflight import SingleFlight
+
+
+@lru_cache(maxsize=64)
+def schema_json(schema: Type[BaseModel]) -> dict:
+    return schema.model_json_schema()
+
+
+class LLMCache:
+    """Content-addressed cache for structured-output LLM calls.
+
+    The key is a hash of model, output schema and prompt messages. Identical calls
+    that are in flight at the same time share one request to the model. With a scheduler, requests
+    to the model are admitted by it, charged with the prompt size plus completion_estimate tokens.
+    Token usage, including the prompt tokens served from the provider's prefix cache, is counted
+    per output schema. Each caller waits until its own request deadline; a call shared by several
+    requests is not bound by any one of them and is cancelled once none of its callers waits for it.
+    """
+
+    def __init__(self, cache: TieredCache, enabled: bool = True,
+                 scheduler: Optional[UpstreamScheduler] = None, completion_estimate: int = 400):
+        self.cache = cache
+        self.enabled = enabled
+        self.scheduler = scheduler
+        self.completion_estimate = completion_estimate
+        self.flights = SingleFlight()
+        self._chains = {}
+        self._chains_llm = None
+        self.stats = {
+            'calls': 0, 'hits': 0, 'misses': 0, 'coalesced': 0,
+            'prompt_tokens': 0, 'cached_prompt_tokens': 0, 'completion_tokens': 0,
+            'prompt_tokens_saved': 0, 'completion_tokens_saved': 0,
+        }
+        self.by_schema = {}
+
+    @staticmethod
+    def make_key(model: str, schema: Type[BaseModel], messages: List) -> str:
+        payload = json.dumps({
+            'model': model,
+            'schema': schema_json(schema),
+            'messages': [[message.type, message.content] for message in messages],
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def chain(self, llm, schema: Type[BaseModel]):
+        """Structured-output runnable of llm for schema, built once per model client"""
+        if self._chains_llm is not llm:
+            self._chains, self._chains_llm = {}, llm
+        chain = self._chains.get(schema)
+        if chain is None:
+            chain = self._chains[schema] = llm.with_structured_output(schema, include_raw=True)
+        return chain
+
+    async def invoke(self, llm, schema: Type[BaseModel], messages: List, use_cache: bool = True,
+                     priority: Optional[int] = None) -> BaseModel:
+        self.stats['calls'] += 1
+        if not (self.enabled and use_cache):
+            async with timeout_scope():
+                return await self._call(llm, schema, messages, None, priority)
+
+        key = self.make_key(llm.model_name, schema, messages)
+        cached = await self.cache.get(key)
+        if cached is not None:
+            self.stats['hits'] += 1
+            self.stats['prompt_tokens_saved'] += cached['usage'].get('input_tokens', 0)
+            self.stats['completion_tokens_saved'] += cached['usage'].get('output_tokens', 0)
+            return schema.model_validate(cached['result'])
+
+        if key in self.flights:
+            self.stats['coalesced'] += 1
+            CACHE_LOOKUPS.labels(self.cache.name, 'coalesced').inc()
+        else:
+            self.stats['misses'] += 1
+        async with timeout_scope():
+            return await self.flights.do(key, lambda: self._shared_call(llm, schema, messages, key, priority))
+
+    async def _shared_call(self, llm, schema: Type[BaseModel], messages: List, key, priority: Optional[int]):
+        # The task copied the first caller's context: its deadline must not cut the call short for later callers
+        request_deadline.set(None)
+        return await self._call(llm, schema, messages, key, priority)
+
+    async def _call(self, llm, schema: Type[BaseModel], messages: List, key, priority: Optional[int]) -> BaseModel:
+        chain = self.chain(llm, schema)
+        timing = {}
+
+        async def request():
+            # Only the last attempt is timed, without time spent queued in the scheduler
+            timing['started'] = time.perf_counter()
+            return await chain.ainvoke(messages)
+
+        if self.scheduler is None:
+            output = await request()
+        else:
+            # System messages are the static part of a prompt, their size is computed once
+            estimate = sum(count_static_tokens(message.content) if message.type == 'system'
+                           else count_tokens(message.content) for message in messages) + self.completion_estimate
+            output = await self.scheduler.submit(request, priority=priority, tokens=estimate)
+        seconds = time.perf_counter() - timing['started']
+        if output.get('parsing_error') is not None:
+            raise output['parsing_error']
+        if output.get('parsed') is None:
+            raise ValueError(f"Model returned no {schema.__name__}")
+
+        usage = getattr(output['raw'], 'usage_metadata', None) or {}
+        cached = (usage.get('input_token_details') or {}).get('cache_read') or 0
+        usage = {'input_tokens': usage.get('input_tokens', 0), 'cached_tokens': cached,
+                 'output_tokens': usage.get('output_tokens', 0)}
+        if self.scheduler is not None and usage['input_tokens']:
+            self.scheduler.settle(estimate, usage['input_tokens'] + usage['output_tokens'])
+        self.record_usage(schema.__name__, usage, seconds)
+
+        result = output['parsed']
+        if key is not None:
+            await self.cache.set(key, {'result': result.model_dump(), 'usage': usage})
+        return result
+
+    def record_usage(self, call: str, usage: dict, seconds: float):
+        self.stats['prompt_tokens'] += usage['input_tokens']
+        self.stats['cached_prompt_tokens'] += usage['cached_tokens']
+        self.stats['completion_tokens'] += usage['output_tokens']
+        LLM_TOKENS.labels(call, 'prompt').observe(usage['input_tokens'])
+        LLM_TOKENS.labels(call, 'cached').observe(usage['cached_tokens'])
+        LLM_TOKENS.labels(call, 'completion').observe(usage['output_tokens'])
+
+        stats = self.by_schema.setdefault(call, {
+            'calls': 0, 'prompt_tokens': 0, 'cached_prompt_tokens': 0, 'completion_tokens': 0, 'seconds': 0.0,
+        })
+        stats['calls'] += 1
+        stats['prompt_tokens'] += usage['input_tokens']
+        stats['cached_prompt_tokens'] += usage['cached_tokens']
+        stats['completion_tokens'] += usage['output_tokens']
+        stats['seconds'] += seconds
+
+    def get_stats(self) -> dict:
+        lookups = self.stats['hits'] + self.stats['misses'] + self.stats['coalesced']
+        return {
+            **self.stats,
+            'hit_rate': round((self.stats['hits'] + self.stats['coalesced']) / lookups, 4) if lookups else 0.0,
+            'prefix_cache_rate': round(self.stats['cached_prompt_tokens'] / self.stats['prompt_tokens'], 4)
+            if self.stats['prompt_tokens'] else 0.0,
+            'by_call': {
+                call: {**stats, 'avg_seconds': round(stats['seconds'] / stats['calls'], 4)}
+                for call, stats in self.by_schema.items()
+            },
+            'storage': self.cache.get_stats(),
+        }
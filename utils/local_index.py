@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import time
+from typing import List, Optional, Set, Tuple
+
+from utils.ranker import tokenize
+from utils.sqlite_db import SharedSQLite
+
+
+class LocalIndex:
+    """Persistent SQLite FTS5 index of cleaned page texts, shared by all workers.
+
+    Pages are added incrementally: an unchanged text only refreshes its timestamp, a changed one
+    replaces the indexed row. `search` returns pages that contain at least min_coverage of the
+    query terms, best BM25 first; pages not (re)indexed within max_age seconds are left out.
+    """
+
+    def __init__(self, path: str, max_age: float = 0):
+        self.path = path
+        self.max_age = max_age
+        self.db = SharedSQLite(
+            path,
+            'CREATE TABLE IF NOT EXISTS pages '
+            '(id INTEGER PRIMARY KEY, url TEXT UNIQUE NOT NULL, hash TEXT NOT NULL, indexed_at REAL NOT NULL)',
+            "CREATE VIRTUAL TABLE IF NOT EXISTS pages_fts USING fts5(text, tokenize='unicode61 remove_diacritics 2')",
+        )
+        self._pending: Set[asyncio.Task] = set()
+        self.stats = {
+            'queries': 0, 'local_hits': 0, 'local_misses': 0, 'query_seconds': 0.0, 'max_query_seconds': 0.0,
+            'added': 0, 'updated': 0, 'unchanged': 0, 'errors': 0,
+        }
+
+    def add(self, url: str, text: str) -> str:
+        """Index or refresh a page, returns 'added', 'updated' or 'unchanged'"""
+        with self.db.lock:
+            outcome = self._add(url, text)
+        self.stats[outcome] += 1
+        return outcome
+
+    def _add(self, url: str, text: str) -> str:
+        conn = self.db.connection()
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        now = time.time()
+        row = conn.execute('SELECT id, hash FROM pages WHERE url = ?', (url,)).fetchone()
+        if row is not None and row[1] == digest:
+            conn.execute('UPDATE pages SET indexed_at = ? WHERE id = ?', (now, row[0]))
+            outcome = 'unchanged'
+        else:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if row is None:
+                    page_id = conn.execute('INSERT INTO pages (url, hash, indexed_at) VALUES (?, ?, ?)',
+                                           (url, digest, now)).lastrowid
+                    outcome = 'added'
+                else:
+                    page_id = row[0]
+                    conn.execute('UPDATE pages SET hash = ?, indexed_at = ? WHERE id = ?', (digest, now, page_id))
+                    conn.execute('DELETE FROM pages_fts WHERE rowid = ?', (page_id,))
+                    outcome = 'updated'
+                conn.execute('INSERT INTO pages_fts (rowid, text) VALUES (?, ?)', (page_id, text))
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return outcome
+
+    def indexed_at(self, url: str) -> Optional[float]:
+        with self.db.lock:
+            row = self.db.connection().execute('SELECT indexed_at FROM pages WHERE url = ?', (url,)).fetchone()
+        return row[0] if row else None
+
+    def search(self, query: str, limit: int = 5, min_coverage: float = 0.6) -> List[Tuple[str, str]]:
+        """(url, text) of the best pages that contain at least min_coverage of the query terms"""
+        started = time.perf_counter()
+        terms = list(dict.fromkeys(term for term in tokenize(query) if len(term) >= 3))
+        pages = []
+        if terms:
+            match = ' OR '.join(f'"{term}"*' for term in terms)
+            # Stale pages are not served; they come back once fetched from the web again
+            fresh_since = time.time() - self.max_age if self.max_age else 0
+            with self.db.lock:
+                rows = self.db.connection().execute(
+                    'SELECT pages.url, pages_fts.text FROM pages_fts JOIN pages ON pages.id = pages_fts.rowid '
+                    'WHERE pages_fts MATCH ? AND pages.indexed_at >= ? ORDER BY bm25(pages_fts) LIMIT ?',
+                    (match, fresh_since, limit * 4),
+                ).fetchall()
+            for url, text in rows:
+                present = set(tokenize(text))
+                if sum(term in present for term in terms) >= min_coverage * len(terms):
+                    pages.append((url, text))
+                    if len(pages) >= limit:
+                        break
+        elapsed = time.perf_counter() - started
+        self.stats['queries'] += 1
+        self.stats['query_seconds'] += elapsed
+        self.stats['max_query_seconds'] = max(self.stats['max_query_seconds'], elapsed)
+        return pages
+
+    async def search_async(self, query: str, limit: int = 5, min_coverage: float = 0.6) -> List[Tuple[str, str]]:
+        try:
+            return await asyncio.to_thread(self.search, query, limit, min_coverage)
+        except sqlite3.Error:
+            self.stats['errors'] += 1
+            return []
+
+    def record(self, hit: bool):
+        """Count whether local recall was enough to skip the web search"""
+        self.stats['local_hits' if hit else 'local_misses'] += 1
+
+    def add_later(self, url: str, text: str):
+        """Index in a background thread without holding up the caller"""
+        task = asyncio.ensure_future(asyncio.to_thread(self.add, url, text))
+        self._pending.add(task)
+        task.add_done_callback(self._added)
+
+    def _added(self, task: asyncio.Task):
+        self._pending.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.stats['errors'] += 1
+
+    def get_stats(self) -> dict:
+        stats = {**self.stats, 'pending_writes': len(self._pending)}
+        try:
+            with self.db.lock:
+                stats['documents'] = self.db.connection().execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+            stats['size_bytes'] = sum(os.path.getsize(self.path + suffix)
+                                      for suffix in ('', '-wal') if os.path.exists(self.path + suffix))
+        except (sqlite3.Error, OSError):
+            stats['errors'] += 1
+        queries = self.stats['queries']
+        stats['avg_query_seconds'] = self.stats['query_seconds'] / queries if queries else 0.0
+        return stats
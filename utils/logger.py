@@ -1,34 +1,54 @@
+import logging
+import os
+import queue
 import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
 
-from aiologger import Logger
-from aiologger.formatters.base import Formatter
-from aiologger.handlers.files import AsyncFileHandler
-from aiologger.handlers.streams import AsyncStreamHandler
-from aiologger.levels import LogLevel
+_listener: Optional[QueueListener] = None
+_listener_started = False
 
 
-async def setup_logger():
-    # Create logger instance
-    logger = Logger(name="api_logger")
+def setup_logger(name: str = "api_logger", filename: str = "logs/api.log") -> logging.Logger:
+    # Create logger instance; records only go into a queue, handlers run in the listener thread
+    logger = logging.getLogger(name)
+    if any(isinstance(handler, QueueHandler) for handler in logger.handlers):
+        return logger
 
     # Create formatter
-    formatter = Formatter(
+    formatter = logging.Formatter(
         fmt="{asctime} | {levelname} | {message}",
         datefmt="%Y-%m-%d %H:%M:%S",
         style="{",
     )
 
-    file_handler = AsyncFileHandler(
-        filename="logs/api.log",
-        mode="a",
-        encoding="utf-8",
-    )
-    stream_handler = AsyncStreamHandler(stream=sys.stdout)
-    file_handler.formatter = formatter
-    stream_handler.formatter = formatter
-    logger.add_handler(file_handler)
-    logger.add_handler(stream_handler)
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    file_handler = logging.FileHandler(filename=filename, mode="a", encoding="utf-8", delay=True)
+    stream_handler = logging.StreamHandler(stream=sys.stdout)
+    file_handler.setFormatter(formatter)
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    global _listener
+    _listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    return logger
+
+
+def start_logger():
+    """Start the listener thread that writes queued records (after fork, in each worker)"""
+    global _listener_started
+    if _listener is not None and not _listener_started:
+        _listener.start()
+        _listener_started = True
 
-    logger.level = LogLevel.INFO
 
-    return logger
\ No newline at end of file
+def stop_logger():
+    """Flush queued records and stop the listener thread"""
+    global _listener_started
+    if _listener is not None and _listener_started:
+        _listener.stop()
+        _listener_started = False
@@ -0,0 +1,44 @@
+import asyncio
+import time
+from typing import Optional
+
+
+class LoopLagMonitor:
+    """Measures how long the event loop was blocked by oversleeping a periodic timer"""
+
+    def __init__(self, interval: float = 0.1, stall_threshold: float = 0.05):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {'samples': 0, 'lag_seconds': 0.0, 'max_lag_seconds': 0.0, 'stalls': 0}
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - started - self.interval, 0.0)
+            self.stats['samples'] += 1
+            self.stats['lag_seconds'] += lag
+            self.stats['max_lag_seconds'] = max(self.stats['max_lag_seconds'], lag)
+            if lag > self.stall_threshold:
+                self.stats['stalls'] += 1
+
+    def get_stats(self) -> dict:
+        samples = self.stats['samples']
+        return {
+            **self.stats,
+            'avg_lag_seconds': self.stats['lag_seconds'] / samples if samples else 0.0,
+        }
@@ -0,0 +1,45 @@
+import os
+import time
+from contextlib import contextmanager
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import REGISTRY, multiprocess
+
+# With PROMETHEUS_MULTIPROC_DIR set (see start.sh) every gunicorn worker writes its samples
+# to that directory and /metrics aggregates them, whichever worker serves the scrape
+
+STAGE_LATENCY = Histogram(
+    'ai_qa_stage_seconds', 'Latency of answer pipeline stages', ['stage'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120),
+)
+LLM_TOKENS = Histogram(
+    'ai_qa_llm_call_tokens', 'Tokens per LLM call', ['call', 'kind'],
+    buckets=(50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000),
+)
+ITERATIONS = Histogram(
+    'ai_qa_answer_iterations', 'Search iterations (or speculative branches) used per answer',
+    buckets=(1, 2, 3, 4, 6, 8),
+)
+FETCH_FAILURES = Counter('ai_qa_fetch_failures_total', 'Failed page fetches', ['reason'])
+CACHE_LOOKUPS = Counter('ai_qa_cache_lookups_total', 'Cache lookups', ['cache', 'result'])
+UPSTREAM_CALLS = Counter('ai_qa_upstream_calls_total', 'Scheduled calls to LLM and search upstreams', ['upstream', 'result'])
+
+
+@contextmanager
+def span(stage: str):
+    """Observe the duration of a stage in STAGE_LATENCY"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(stage).observe(time.perf_counter() - started)
+
+
+def render_metrics() -> tuple:
+    """Prometheus exposition of all workers' metrics and its content type"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
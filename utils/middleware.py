@@ -0,0 +1,83 @@
+import logging
+import random
+import time
+
+# Starlette instantiates middleware lazily, so the counters live at module level
+middleware_stats = {'requests': 0, 'overhead_seconds': 0.0, 'max_overhead_seconds': 0.0}
+
+
+class RequestLoggingMiddleware:
+    """ASGI middleware that logs requests without buffering bodies.
+
+    Messages are passed through untouched; for a sampled share of requests the first
+    body_max_bytes of the request and response bodies are copied for the log record.
+    """
+
+    def __init__(self, app, logger: logging.Logger, body_sample_rate: float = 1.0, body_max_bytes: int = 2048):
+        self.app = app
+        self.logger = logger
+        self.body_sample_rate = body_sample_rate
+        self.body_max_bytes = body_max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        overhead = 0.0
+        capture = self.body_max_bytes > 0 and random.random() < self.body_sample_rate
+        request_body = bytearray()
+        response_body = bytearray()
+        status = None
+
+        def keep(buffer: bytearray, body: bytes):
+            if len(buffer) < self.body_max_bytes:
+                buffer.extend(body[:self.body_max_bytes - len(buffer)])
+
+        async def receive_wrapper():
+            nonlocal overhead
+            message = await receive()
+            mark = time.perf_counter()
+            if message['type'] == 'http.request':
+                keep(request_body, message.get('body', b''))
+            overhead += time.perf_counter() - mark
+            return message
+
+        async def send_wrapper(message):
+            nonlocal status, overhead
+            mark = time.perf_counter()
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif capture and message['type'] == 'http.response.body':
+                keep(response_body, message.get('body', b''))
+            overhead += time.perf_counter() - mark
+            await send(message)
+
+        overhead += time.perf_counter() - started
+        try:
+            await self.app(scope, receive_wrapper if capture else receive, send_wrapper)
+        finally:
+            mark = time.perf_counter()
+            method, path = scope['method'], scope['path']
+            if capture:
+                self.logger.info(
+                    f"Request completed: {method} {path}\n"
+                    f"Status: {status}\n"
+                    f"Request body: {request_body.decode(errors='replace')}\n"
+                    f"Response body: {response_body.decode(errors='replace')}\n"
+                    f"Duration: {mark - started:.3f}s"
+                )
+            else:
+                self.logger.info(f"Request completed: {method} {path} | Status: {status} | Duration: {mark - started:.3f}s")
+            overhead += time.perf_counter() - mark
+            middleware_stats['requests'] += 1
+            middleware_stats['overhead_seconds'] += overhead
+            middleware_stats['max_overhead_seconds'] = max(middleware_stats['max_overhead_seconds'], overhead)
+
+
+def get_middleware_stats() -> dict:
+    requests = middleware_stats['requests']
+    return {
+        **middleware_stats,
+        'avg_overhead_seconds': middleware_stats['overhead_seconds'] / requests if requests else 0.0,
+    }
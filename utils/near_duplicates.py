@@ -0,0 +1,80 @@
+import re
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+
+WORD_RE = re.compile(r'\w+')
+
+dedup_stats = {'pages': 0, 'duplicates': 0, 'llm_calls_saved': 0, 'tokens_saved': 0}
+
+
+def shingle_hashes(text: str, size: int = 5) -> np.ndarray:
+    """Distinct 64-bit hashes of the word size-grams of the text"""
+    words = WORD_RE.findall(text.lower().replace('ё', 'е'))
+    if not words:
+        return np.zeros(0, dtype=np.uint64)
+    ids = {}
+    hashes = np.fromiter((ids.setdefault(word, zlib.crc32(word.encode('utf-8'))) for word in words),
+                         dtype=np.uint64, count=len(words))
+    size = min(size, len(words))
+    count = len(words) - size + 1
+    # Polynomial rolling combination, uint64 arithmetic wraps around
+    shingles = np.zeros(count, dtype=np.uint64)
+    for offset in range(size):
+        shingles = shingles * np.uint64(0x100000001B3) + hashes[offset:offset + count]
+    return np.unique(shingles)
+
+
+class NearDuplicateFilter:
+    """MinHash over word shingles: a page whose estimated Jaccard similarity to an already kept
+    page is at least threshold is reported as that page's duplicate instead of being kept.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hash family: odd multipliers, the high 32 bits of a*x + b
+        self.a = rng.integers(1, 2 ** 63, num_perm, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+        self.urls: List[str] = []
+        self.signatures: List[np.ndarray] = []
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        shingles = shingle_hashes(text, self.shingle_size)
+        if not len(shingles):
+            return None
+        values = (shingles[None, :] * self.a[:, None] + self.b[:, None]) >> np.uint64(32)
+        return values.min(axis=1)
+
+    def add(self, url: str, text: str) -> Optional[str]:
+        """URL of the kept page this one duplicates, or None after keeping it"""
+        dedup_stats['pages'] += 1
+        signature = self.signature(text)
+        if signature is None:
+            return None
+        if self.signatures:
+            similarity = (np.stack(self.signatures) == signature).mean(axis=1)
+            best = int(similarity.argmax())
+            if similarity[best] >= self.threshold:
+                dedup_stats['duplicates'] += 1
+                return self.urls[best]
+        self.urls.append(url)
+        self.signatures.append(signature)
+        return None
+
+
+def record_saved(calls: int, tokens: int):
+    """Count the summarization work a collapsed duplicate did not cost"""
+    dedup_stats['llm_calls_saved'] += calls
+    dedup_stats['tokens_saved'] += tokens
+
+
+def merge_mirrors(*mappings: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    merged: Dict[str, List[str]] = {}
+    for mapping in mappings:
+        for url, mirrors in mapping.items():
+            merged.setdefault(url, [])
+            merged[url] += [mirror for mirror in mirrors if mirror not in merged[url]]
+    return merged
@@ -0,0 +1,172 @@
+import re
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from utils.ranker import tokenize
+
+OPTION_RE = re.compile(r'^\s*(\d+)\.\s*(.+?)\s*$', re.MULTILINE)
+DASH_RE = re.compile('[‐-―−]')
+SPACE_RE = re.compile(r'\s+')
+RANGE_RE = re.compile(r'(\d+)\s*-\s*(\d+)')
+GROUPED_NUMBER_RE = re.compile(r'\d{1,3}(?:[ ,.]\d{3})+')
+DATE_RE = re.compile(r'(\d{1,2})\.(\d{1,2})\.(\d{4})')
+# "Which of these is NOT ...": the option found in the pages is the wrong answer
+NEGATION_RE = re.compile(r'\b(?:не|кроме|за исключением|неверн\w*|неправильн\w*|ошибочн\w*)\b')
+
+MONTHS = ['января', 'февраля', 'марта', 'апреля', 'мая', 'июня',
+          'июля', 'августа', 'сентября', 'октября', 'ноября', 'декабря']
+
+# Interrogative and copula stems occur near any fact, so they do not count as question context
+QUESTION_WORDS = frozenset(tokenize(
+    'какой какая какое какие каком каких какого какому которые который которая которое котором которых '
+    'сколько когда почему является являются являлся являлась являлось являлись были было была будет будут '
+    'этот эта это эти'
+))
+
+matcher_stats = {'questions': 0, 'generic_options': 0, 'negated': 0, 'pages': 0, 'answers': 0, 'ambiguous': 0}
+
+
+def normalize(text: str) -> str:
+    """Lowercase, ё→е, one kind of dash and single spaces: options and pages are compared in this form"""
+    text = text.lower().replace('ё', 'е').replace('\xa0', ' ')
+    return SPACE_RE.sub(' ', DASH_RE.sub('-', text))
+
+
+def parse_options(question: str) -> Dict[int, str]:
+    return {int(number): text for number, text in OPTION_RE.findall(question)}
+
+
+def option_variants(option: str, min_length: int = 4) -> List[str]:
+    """Surface forms an option can take in a page; too short forms ("5", "ФТФ") are dropped as non-distinctive"""
+    base = normalize(option).strip(' .,;:!?"«»')
+    variants = {base}
+
+    match = RANGE_RE.fullmatch(base)
+    if match:
+        start, end = match.groups()
+        variants.update({f'{start}-{end}', f'{start} - {end}', f'с {start} по {end}',
+                         f'{start} по {end}', f'от {start} до {end}'})
+    if GROUPED_NUMBER_RE.fullmatch(base):
+        digits = re.sub(r'\D', '', base)
+        variants.update({digits, f'{int(digits):,}'.replace(',', ' ')})
+    elif base.isdigit() and len(base) > 4:
+        variants.add(f'{int(base):,}'.replace(',', ' '))
+    match = DATE_RE.fullmatch(base)
+    if match and 1 <= int(match.group(2)) <= 12:
+        day, month, year = match.groups()
+        variants.add(f'{int(day)} {MONTHS[int(month) - 1]} {year}')
+
+    return [variant for variant in variants if len(variant) >= min_length]
+
+
+class AhoCorasick:
+    """Multi-pattern automaton: every occurrence of every pattern in one pass over the text"""
+
+    def __init__(self, patterns: List[str]):
+        self.patterns = patterns
+        self.goto: List[dict] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[list] = [[]]
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for char in pattern:
+                if char not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[state][char] = len(self.goto) - 1
+                state = self.goto[state][char]
+            self.output[state].append(index)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, target in self.goto[state].items():
+                queue.append(target)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[target] = self.goto[fallback].get(char, 0)
+                self.output[target] += self.output[self.fail[target]]
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, int, int]]:
+        """Yields (start, end, pattern index) for every match"""
+        goto, fail, output, patterns = self.goto, self.fail, self.output, self.patterns
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for index in output[state]:
+                yield position + 1 - len(patterns[index]), position + 1, index
+
+
+class OptionMatcher:
+    """Finds which answer options occur verbatim in the pages, near words from the question.
+
+    The answer is decided only when exactly one option was found, in at least min_sources pages,
+    and every option has a distinctive form (a single digit matches anything, so such questions
+    are left to the LLM). Questions with negation or exclusion ("не", "кроме") are left to the LLM too.
+    """
+
+    def __init__(self, question: str, min_sources: int = 2, min_context: int = 2, window: int = 300):
+        self.min_sources = min_sources
+        self.min_context = min_context
+        self.window = window
+        self.options = parse_options(question)
+        stem = OPTION_RE.sub(' ', question)
+        option_tokens = set(tokenize(' '.join(self.options.values())))
+        self.keywords = {token for token in tokenize(stem) if len(token) >= 4} - option_tokens - QUESTION_WORDS
+        self.negated = NEGATION_RE.search(normalize(stem)) is not None
+
+        patterns, self.owners = [], []
+        variants = {number: option_variants(text) for number, text in self.options.items()}
+        for number, forms in variants.items():
+            for form in forms:
+                patterns.append(form)
+                self.owners.append(number)
+        distinctive = len(self.options) >= 2 and all(variants.values())
+        self.usable = distinctive and not self.negated
+        self.automaton = AhoCorasick(patterns) if self.usable else None
+        self.evidence: Dict[int, List[str]] = {}
+        matcher_stats['questions'] += 1
+        if not distinctive:
+            matcher_stats['generic_options'] += 1
+        elif self.negated:
+            matcher_stats['negated'] += 1
+
+    def _in_context(self, text: str, start: int, end: int) -> bool:
+        if self.min_context <= 0:
+            return True
+        around = text[max(start - self.window, 0):start] + ' ' + text[end:end + self.window]
+        return len(self.keywords.intersection(tokenize(around))) >= self.min_context
+
+    def add_page(self, url: str, text: str):
+        if not self.usable or not text:
+            return
+        matcher_stats['pages'] += 1
+        text = normalize(text)
+        found = set()
+        for start, end, index in self.automaton.finditer(text):
+            number = self.owners[index]
+            if number in found:
+                continue
+            # Whole words only: "25" must not match inside "250" or "2025"
+            if (start > 0 and text[start - 1].isalnum()) or (end < len(text) and text[end].isalnum()):
+                continue
+            if self._in_context(text, start, end):
+                found.add(number)
+        for number in found:
+            self.evidence.setdefault(number, []).append(url)
+
+    def decide(self) -> Optional[Tuple[int, List[str]]]:
+        """(option, source urls) when the evidence points to exactly one option, else None"""
+        if len(self.evidence) != 1:
+            if len(self.evidence) > 1:
+                matcher_stats['ambiguous'] += 1
+            return None
+        (number, urls), = self.evidence.items()
+        if len(urls) < self.min_sources:
+            return None
+        matcher_stats['answers'] += 1
+        return number, urls
@@ -0,0 +1,125 @@
+import asyncio
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from utils.cache import SQLiteTTLCache
+from utils.metrics import CACHE_LOOKUPS
+
+
+class PageCache:
+    """Cleaned page text keyed by final URL, bounded by a byte budget with LRU eviction.
+
+    Entries younger than fresh_ttl are served as is; older ones keep their ETag /
+    Last-Modified so the caller can revalidate them with a conditional GET.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, fresh_ttl: float = 600,
+                 ttl: float = 7 * 24 * 3600, path: Optional[str] = None, disk_maxsize: int = 50000):
+        self.max_bytes = max_bytes
+        self.fresh_ttl = fresh_ttl
+        self.ttl = ttl
+        self.disk = SQLiteTTLCache(path, table='pages', maxsize=disk_maxsize, ttl=ttl) if path else None
+        self._entries: OrderedDict = OrderedDict()
+        # requested url -> final url after redirects
+        self._aliases: OrderedDict = OrderedDict()
+        self._bytes = 0
+        self.stats = {'fresh_hits': 0, 'revalidated': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'errors': 0}
+
+    def _lookup(self, url: str) -> Optional[dict]:
+        final_url = self._aliases.get(url, url)
+        entry = self._entries.get(final_url)
+        if entry is not None:
+            self._entries.move_to_end(final_url)
+        return entry
+
+    def _insert(self, entry: dict):
+        old = self._entries.pop(entry['url'], None)
+        if old is not None:
+            self._bytes -= old['size']
+        if entry['size'] > self.max_bytes:
+            return
+        self._entries[entry['url']] = entry
+        self._bytes += entry['size']
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted['size']
+            self.stats['evictions'] += 1
+
+    def _alias(self, url: str, final_url: str):
+        if url == final_url:
+            return
+        self._aliases[url] = final_url
+        self._aliases.move_to_end(url)
+        while len(self._aliases) > 4 * max(len(self._entries), 1024):
+            self._aliases.popitem(last=False)
+
+    async def get(self, url: str) -> Optional[dict]:
+        entry = self._lookup(url)
+        if entry is None and self.disk is not None:
+            try:
+                entry = await asyncio.to_thread(self.disk.get, url)
+            except sqlite3.Error:
+                self.stats['errors'] += 1
+            if entry is not None:
+                self._insert(entry)
+                self._alias(url, entry['url'])
+        if entry is None:
+            self.record('miss')
+        return entry
+
+    def record(self, result: str):
+        """Count a lookup outcome: 'miss', 'fresh_hit' or 'revalidated'"""
+        self.stats[{'miss': 'misses', 'fresh_hit': 'fresh_hits'}.get(result, result)] += 1
+        CACHE_LOOKUPS.labels('pages', result).inc()
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry['validated_at'] < self.fresh_ttl
+
+    @staticmethod
+    def conditional_headers(entry: Optional[dict]) -> dict:
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    async def put(self, url: str, final_url: str, text: str, etag: Optional[str] = None,
+                  last_modified: Optional[str] = None, complete: bool = True) -> dict:
+        entry = {
+            'url': final_url,
+            'text': text,
+            'complete': complete,
+            'etag': etag,
+            'last_modified': last_modified,
+            'validated_at': time.time(),
+            'size': len(text.encode('utf-8')),
+        }
+        self._insert(entry)
+        self._alias(url, final_url)
+        self.stats['stores'] += 1
+        await self._persist(url, entry)
+        return entry
+
+    async def mark_validated(self, url: str, entry: dict) -> dict:
+        """Refresh an entry after a 304 Not Modified"""
+        entry = {**entry, 'validated_at': time.time()}
+        self._insert(entry)
+        await self._persist(url, entry)
+        return entry
+
+    async def _persist(self, url: str, entry: dict):
+        if self.disk is None:
+            return
+        try:
+            await asyncio.to_thread(self.disk.set, entry['url'], entry)
+            if url != entry['url']:
+                await asyncio.to_thread(self.disk.set, url, entry)
+        except sqlite3.Error:
+            self.stats['errors'] += 1
+
+    def get_stats(self) -> dict:
+        return {**self.stats, 'entries': len(self._entries), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
@@ -0,0 +1,129 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+
+def _apply_batch(func: Callable, items: list) -> list:
+    """Runs in the pool process: one IPC round trip for a whole batch"""
+    results = []
+    for item in items:
+        try:
+            results.append((True, func(item)))
+        except Exception as e:
+            results.append((False, repr(e)))
+    return results
+
+
+class ParseExecutor:
+    """Runs a CPU-bound parse function inline or in a process pool.
+
+    mode 'inline' keeps everything on the event loop, 'process' sends everything
+    to the pool and 'auto' only offloads inputs longer than inline_threshold.
+    Offloaded inputs are grouped into batches of up to batch_size items or
+    whatever arrived within batch_delay seconds.
+    """
+
+    def __init__(self, func: Callable, mode: str = 'auto', inline_threshold: int = 200_000,
+                 workers: Optional[int] = None, batch_size: int = 8, batch_delay: float = 0.005):
+        if mode not in ('inline', 'process', 'auto'):
+            raise ValueError(f"Unknown parse mode: {mode}")
+        self.func = func
+        self.mode = mode
+        self.inline_threshold = inline_threshold
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pid = None
+        self._pending: list = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._batches: set = set()
+        self.stats = {
+            'inline_calls': 0, 'inline_seconds': 0.0, 'inline_max_seconds': 0.0,
+            'offloaded_calls': 0, 'offloaded_seconds': 0.0, 'batches': 0, 'errors': 0,
+        }
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # The pool has to be created in the worker process itself, not inherited over fork
+        if self._pool is None or self._pid != os.getpid():
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            self._pid = os.getpid()
+        return self._pool
+
+    def start(self):
+        if self.mode != 'inline':
+            self._get_pool()
+
+    def shutdown(self):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+
+    async def run(self, item):
+        if self.mode == 'inline' or (self.mode == 'auto' and len(item) < self.inline_threshold):
+            return self._run_inline(item)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(self.batch_delay, self._flush)
+        return await future
+
+    def _run_inline(self, item):
+        started = time.perf_counter()
+        try:
+            return self.func(item)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stats['inline_calls'] += 1
+            self.stats['inline_seconds'] += elapsed
+            self.stats['inline_max_seconds'] = max(self.stats['inline_max_seconds'], elapsed)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        # Spread the batch over the pool workers, one chunk (and one IPC round trip) per worker
+        chunk_size = -(-len(batch) // self.workers)
+        for i in range(0, len(batch), chunk_size):
+            task = asyncio.ensure_future(self._run_batch(batch[i:i + chunk_size]))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _run_batch(self, batch: list):
+        self.stats['batches'] += 1
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self._get_pool(), _apply_batch, self.func, [b[0] for b in batch])
+        except BrokenProcessPool as e:
+            self._pool = None
+            results = [(False, repr(e))] * len(batch)
+        except Exception as e:
+            results = [(False, repr(e))] * len(batch)
+
+        finished = time.perf_counter()
+        for (_, future, queued_at), (ok, value) in zip(batch, results):
+            self.stats['offloaded_calls'] += 1
+            self.stats['offloaded_seconds'] += finished - queued_at
+            if future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                self.stats['errors'] += 1
+                future.set_exception(RuntimeError(value))
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            'mode': self.mode,
+            'inline_threshold': self.inline_threshold,
+            'workers': self.workers if self.mode != 'inline' else 0,
+            'pending': len(self._pending),
+        }
@@ -0,0 +1,95 @@
+import re
+from functools import lru_cache
+
+import numpy as np
+
+WORD_RE = re.compile(r'\w+')
+
+ranking_stats = {'pages': 0, 'ranked_pages': 0, 'input_tokens': 0, 'selected_tokens': 0}
+
+
+@lru_cache(maxsize=1)
+def get_encoding(model: str = 'gpt-4o-mini'):
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        # The BPE file is downloaded on first use; without network fall back to an estimate
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is None:
+        return len(text) // 3 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=256)
+def count_static_tokens(text: str) -> int:
+    """count_tokens for prompt parts that repeat across calls, each text is encoded once"""
+    return count_tokens(text)
+
+
+def tokenize(text: str) -> list:
+    """Lowercased words cut to a 6-letter prefix, a cheap stand-in for Russian stemming"""
+    return [word[:6] for word in WORD_RE.findall(text.lower().replace('ё', 'е'))]
+
+
+def split_passages(text: str, words_per_passage: int = 80, overlap: int = 0) -> list:
+    """Split text into (optionally overlapping) windows of words"""
+    words = text.split()
+    step = max(words_per_passage - overlap, 1)
+    return [' '.join(words[i:i + words_per_passage])
+            for i in range(0, max(len(words) - overlap, 1), step)]
+
+
+def bm25_scores(passages: list, query: str, k1: float = 1.5, b: float = 0.75) -> np.ndarray:
+    """BM25 score of every passage against the query terms, computed as one term-frequency matrix"""
+    vocabulary = {term: i for i, term in enumerate(dict.fromkeys(tokenize(query)))}
+    if not vocabulary or not passages:
+        return np.zeros(len(passages))
+
+    rows, cols, lengths = [], [], []
+    for row, passage in enumerate(passages):
+        tokens = tokenize(passage)
+        lengths.append(len(tokens))
+        for token in tokens:
+            col = vocabulary.get(token)
+            if col is not None:
+                rows.append(row)
+                cols.append(col)
+
+    n_passages, n_terms = len(passages), len(vocabulary)
+    tf = np.bincount(np.asarray(rows, dtype=np.int64) * n_terms + np.asarray(cols, dtype=np.int64),
+                     minlength=n_passages * n_terms).reshape(n_passages, n_terms).astype(np.float64)
+    lengths = np.asarray(lengths, dtype=np.float64)
+    df = (tf > 0).sum(axis=0)
+    idf = np.log((n_passages - df + 0.5) / (df + 0.5) + 1.0)
+    norm = k1 * (1 - b + b * lengths / max(lengths.mean(), 1.0))
+    return (idf * tf * (k1 + 1) / (tf + norm[:, None])).sum(axis=1)
+
+
+def select_passages(content: str, query: str, token_budget: int = 1200, top_k: int = 8,
+                    words_per_passage: int = 80) -> str:
+    """Keep the top-k passages most relevant to the query that fit into token_budget, in page order"""
+    ranking_stats['pages'] += 1
+    total_tokens = count_tokens(content)
+    ranking_stats['input_tokens'] += total_tokens
+    if total_tokens <= token_budget:
+        ranking_stats['selected_tokens'] += total_tokens
+        return content
+
+    passages = split_passages(content, words_per_passage)
+    scores = bm25_scores(passages, query)
+    selected, used = [], 0
+    for index in np.argsort(-scores, kind='stable')[:top_k]:
+        tokens = count_tokens(passages[index])
+        if used + tokens > token_budget:
+            continue
+        selected.append(index)
+        used += tokens
+
+    ranking_stats['ranked_pages'] += 1
+    ranking_stats['selected_tokens'] += used
+    return ' ... '.join(passages[i] for i in sorted(selected))
@@ -0,0 +1,282 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional, Tuple, Type
+
+from utils.deadline import remaining
+from utils.metrics import UPSTREAM_CALLS
+
+# Lower value goes first: final synthesis ahead of regular work ahead of speculative branches
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Default priority for calls that don't pass one, set by callers for a whole subtree of tasks
+current_priority: ContextVar = ContextVar('current_priority', default=PRIORITY_NORMAL)
+
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class Overloaded(Exception):
+    """Raised instead of queueing when the scheduler (or the service) is saturated"""
+
+    def __init__(self, status: int, retry_after: float, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class TokenBucket:
+    """Refills `rate` units per minute up to `capacity`; the balance may go negative to settle estimates"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate / 60.0
+        self.capacity = capacity or rate
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available (amounts above capacity wait for a full bucket)"""
+        self._refill()
+        missing = min(amount, self.capacity) - self.level
+        return missing / self.rate if missing > 0 else 0.0
+
+    def consume(self, amount: float):
+        self._refill()
+        self.level -= amount
+
+
+def _status_of(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, 'status_code', None) or getattr(exc, 'status', None)
+    return status if isinstance(status, int) else None
+
+
+def _retry_after_of(exc: BaseException) -> Optional[float]:
+    headers = getattr(exc, 'headers', None)
+    if headers is None:
+        headers = getattr(getattr(exc, 'response', None), 'headers', None)
+    try:
+        return float(headers.get('retry-after')) if headers else None
+    except (TypeError, ValueError):
+        return None
+
+
+class UpstreamScheduler:
+    """Admits outbound calls to one upstream in priority order within rate and concurrency limits.
+
+    Requests/min and tokens/min are enforced with token buckets; `tokens` passed to `submit` is an
+    estimate that can be corrected afterwards with `settle`. Retryable failures (429, 5xx, timeouts,
+    `retry_exceptions`) are retried with full-jitter exponential backoff, and a 429 pauses the whole
+    upstream for the backoff period. When `max_queue` calls are already waiting `submit` raises
+    Overloaded instead of queueing.
+    """
+
+    def __init__(self, name: str, requests_per_minute: float = 0, tokens_per_minute: float = 0,
+                 max_concurrency: int = 16, max_queue: int = 256, max_retries: int = 4,
+                 backoff_base: float = 0.5, backoff_max: float = 20.0,
+                 retry_exceptions: Tuple[Type[BaseException], ...] = (asyncio.TimeoutError, ConnectionError)):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_exceptions = retry_exceptions
+        self._queue: list = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._paused_until = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.stats = {
+            'submitted': 0, 'completed': 0, 'failed': 0, 'rejected': 0, 'retries': 0, 'rate_limited': 0,
+            'queue_wait_seconds': 0.0, 'max_queue_wait_seconds': 0.0,
+        }
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for entry in self._queue if not entry[3].done())
+
+    def saturated(self) -> bool:
+        return self.queued >= self.max_queue
+
+    def pause_remaining(self) -> float:
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def _wait_time(self, tokens: float) -> float:
+        wait = self.pause_remaining()
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1))
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.wait_time(tokens))
+        return wait
+
+    def _dispatch(self):
+        self._timer = None
+        while self._queue and self._active < self.max_concurrency:
+            priority, _, tokens, future = self._queue[0]
+            if future.done():
+                heapq.heappop(self._queue)
+                continue
+            wait = self._wait_time(tokens)
+            if wait > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            heapq.heappop(self._queue)
+            if self.requests is not None:
+                self.requests.consume(1)
+            if self.tokens is not None and tokens:
+                self.tokens.consume(tokens)
+            self._active += 1
+            future.set_result(None)
+
+    def _kick(self):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._dispatch()
+
+    async def _acquire(self, priority: int, tokens: float):
+        if self.saturated():
+            self.stats['rejected'] += 1
+            UPSTREAM_CALLS.labels(self.name, 'rejected').inc()
+            raise Overloaded(503, max(self.pause_remaining(), 1.0), f"{self.name} queue is full")
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), tokens, future))
+        started = time.monotonic()
+        self._kick()
+        try:
+            await future
+        except asyncio.CancelledError:
+            # The slot may have been granted right before the cancellation
+            if future.done() and not future.cancelled():
+                self._release()
+            future.cancel()
+            raise
+        waited = time.monotonic() - started
+        self.stats['queue_wait_seconds'] += waited
+        self.stats['max_queue_wait_seconds'] = max(self.stats['max_queue_wait_seconds'], waited)
+
+    def _release(self):
+        self._active -= 1
+        self._kick()
+
+    def _backoff(self, attempt: int, exc: BaseException) -> float:
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = _retry_after_of(exc)
+        return max(delay, min(retry_after, self.backoff_max)) if retry_after else delay
+
+    def _retryable(self, exc: BaseException) -> bool:
+        return isinstance(exc, self.retry_exceptions) or _status_of(exc) in RETRY_STATUSES
+
+    async def submit(self, func: Callable[[], Awaitable[Any]], priority: Optional[int] = None, tokens: float = 0) -> Any:
+        """Run func() once admitted, retrying retryable failures"""
+        priority = current_priority.get() if priority is None else priority
+        self.stats['submitted'] += 1
+        attempt = 0
+        while True:
+            await self._acquire(priority, tokens)
+            try:
+                result = await func()
+            except Exception as e:
+                self._release()
+                delay = self._backoff(attempt, e) if self._retryable(e) else None
+                left = remaining()
+                # No retry that could not finish before the request deadline
+                if attempt >= self.max_retries or delay is None or (left is not None and delay >= left):
+                    self.stats['failed'] += 1
+                    UPSTREAM_CALLS.labels(self.name, 'error').inc()
+                    raise
+                if _status_of(e) == 429:
+                    self.stats['rate_limited'] += 1
+                    UPSTREAM_CALLS.labels(self.name, 'rate_limited').inc()
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                self.stats['retries'] += 1
+                UPSTREAM_CALLS.labels(self.name, 'retry').inc()
+                attempt += 1
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self._release()
+                raise
+            self._release()
+            self.stats['completed'] += 1
+            UPSTREAM_CALLS.labels(self.name, 'ok').inc()
+            return result
+
+    def settle(self, estimated: float, actual: float):
+        """Correct the tokens/min bucket once the real token usage of a call is known"""
+        if self.tokens is not None:
+            self.tokens.consume(actual - estimated)
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            'active': self._active,
+            'queued': self.queued,
+            'paused_seconds': round(self.pause_remaining(), 3),
+        }
+
+
+class AdmissionGate:
+    """Per-worker admission control: fails fast instead of letting requests pile up.
+
+    Rejects with 503 when max_inflight requests are already being served and with 429 while
+    an upstream is saturated or paused after a rate limit. Background work (batches) can use
+    wait_enter() to queue for admission instead.
+    """
+
+    def __init__(self, max_inflight: int, *schedulers: UpstreamScheduler,
+                 backoff_base: float = 0.5, backoff_max: float = 20.0):
+        self.max_inflight = max_inflight
+        self.schedulers = schedulers
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.inflight = 0
+        self.stats = {'admitted': 0, 'rejected_busy': 0, 'rejected_upstream': 0, 'waits': 0}
+
+    def check(self):
+        """Raise Overloaded when a new request would be rejected, without admitting one"""
+        if self.max_inflight and self.inflight >= self.max_inflight:
+            self.stats['rejected_busy'] += 1
+            raise Overloaded(503, 1.0, "Too many requests in progress")
+        for scheduler in self.schedulers:
+            paused = scheduler.pause_remaining()
+            if paused > 0 or scheduler.saturated():
+                self.stats['rejected_upstream'] += 1
+                raise Overloaded(429, max(paused, 1.0), f"{scheduler.name} is rate limited")
+
+    def enter(self):
+        self.check()
+        self.inflight += 1
+        self.stats['admitted'] += 1
+
+    async def wait_enter(self, until: float):
+        """enter(), retrying rejections until loop time `until`: each wait lasts at least the
+        rejection's retry_after and grows with full-jitter exponential backoff"""
+        loop = asyncio.get_running_loop()
+        for attempt in itertools.count():
+            try:
+                return self.enter()
+            except Overloaded as e:
+                cap = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+                delay = max(e.retry_after, random.uniform(0, cap))
+                if loop.time() + delay >= until:
+                    raise
+                self.stats['waits'] += 1
+                await asyncio.sleep(delay)
+
+    def leave(self):
+        self.inflight -= 1
+
+    def get_stats(self) -> dict:
+        return {**self.stats, 'inflight': self.inflight, 'max_inflight': self.max_inflight}
@@ -0,0 +1,48 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls with the same key into one in-flight task.
+
+    The shared task is cancelled only when every caller waiting on it has been cancelled.
+    With keep_results successful results stay memoized for the lifetime of the object.
+    Calls missing here go through parent, if given, so they are also shared with its other callers.
+    """
+
+    def __init__(self, keep_results: bool = False, parent: Optional['SingleFlight'] = None):
+        self.keep_results = keep_results
+        self.parent = parent
+        self._calls: dict = {}
+        self.stats = {'calls': 0, 'shared': 0}
+
+    def _forget(self, key: Hashable, task: asyncio.Future):
+        if self.keep_results and not task.cancelled() and task.exception() is None:
+            return
+        call = self._calls.get(key)
+        if call is not None and call[0] is task:
+            del self._calls[key]
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            self.stats['calls'] += 1
+            task = asyncio.ensure_future(self.parent.do(key, func) if self.parent is not None else func())
+            call = self._calls[key] = [task, 0]
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.stats['shared'] += 1
+
+        call[1] += 1
+        try:
+            return await asyncio.shield(call[0])
+        finally:
+            call[1] -= 1
+            if call[1] == 0 and not call[0].done():
+                call[0].cancel()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def __len__(self):
+        return len(self._calls)
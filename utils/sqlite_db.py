@@ -0,0 +1,30 @@
+import os
+import sqlite3
+import threading
+
+
+class SharedSQLite:
+    """SQLite file shared by all worker processes: WAL mode, one connection per process.
+
+    The connection is used from worker threads (asyncio.to_thread), so every statement on it,
+    and opening it, must happen while holding `lock`.
+    """
+
+    def __init__(self, path: str, *schema: str):
+        self.path = path
+        self.schema = schema
+        self.lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    def connection(self) -> sqlite3.Connection:
+        # Connections must not be shared across fork, so reopen per process
+        if self._conn is None or self._pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.schema:
+                conn.execute(statement)
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn